@@ -0,0 +1,272 @@
+"""
+Benchmarks for esdsort, run against synthetic ESD result files.
+
+    python benchmark.py                       # 1k, 10k and 100k parts
+    python benchmark.py --sizes 1000 1000000
+    python benchmark.py --save benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json
+
+Each stage (parse, lookup, aggregate and the three report writers) is
+timed at each size, best of --repeat runs. With --compare, any stage
+slower than the recorded baseline by more than --tolerance is flagged
+and the exit status is 1.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+
+import esdsort
+
+SIZES = (1000, 10000, 100000)
+"""Part counts benchmarked by default (add 1000000 for the full run)"""
+
+VOLTAGES = (500, 1000, 2000, 4000, 8000)
+"""Default zap levels, in volts"""
+
+STAGES = (
+    'parse', 'lookup', 'aggregate',
+    'write_fails', 'write_proc', 'write_volt',
+)
+
+
+def voltage_label(volts):
+    """
+    Return volts as written on a zap line. The tester (and so the
+    parser) only understands a single digit before "KV".
+
+    >>> voltage_label(500), voltage_label(2000)
+    ('500V', '2KV')
+    """
+    if volts % 1000 == 0 and volts < 10000:
+        return "%dKV" % (volts // 1000)
+    return "%dV" % volts
+
+
+def write_tables(directory, processes=6, designs=6):
+    """
+    Write a PROCESS.DAT splitting serial numbers 1-9999 evenly among
+    processes letters, and a DESIGN.DAT splitting resistor values
+    100-999 among designs letters.
+    """
+    def ranges(low, high, count, kind):
+        step = (high - low + 1) // count
+        for i in range(count):
+            stop = high if i == count - 1 else low + step * (i + 1) - 1
+            yield "1 %04d %04d %c %s\n" % (
+                low + step * i, stop, chr(ord('A') + i), kind)
+
+    with open(os.path.join(directory, esdsort.PROCESS_FILENAME), "w") as init:
+        init.writelines(ranges(1, 9999, processes, "Process"))
+    with open(os.path.join(directory, esdsort.DESIGN_FILENAME), "w") as init:
+        init.writelines(ranges(100, 999, designs, "Design"))
+
+
+def generate(
+        stream, parts, voltages=VOLTAGES, fail_rate=0.3,
+        identity_rate=0.01, sr_rate=0.1, seed=0):
+    """
+    Write a synthetic result file of parts parts to stream (text).
+
+    Each part gets an "S/N" line, a zap line at one of voltages, up to
+    three "****" fail lines with a probability of fail_rate, an
+    occasional identity fail, and a closing "938" identity line that
+    carries its resistor value and, now and then, a "FAIL" in column 19.
+    Serial numbers and resistor values are spread evenly over the
+    ranges written by write_tables.
+    """
+    rand = random.Random(seed)
+    codes = sorted(esdsort.FAILCODES)
+    labels = [voltage_label(volts) for volts in voltages]
+    lines = ["ESD TEST RESULTS\n", "\n"]
+    for _ in range(parts):
+        lines.append("DEVICE S/N:   %04d\n" % rand.randint(1, 9999))
+        lines.append("ZAP @ %s HBM\n" % rand.choice(labels))
+        if rand.random() < fail_rate:
+            for code in rand.sample(codes, rand.randint(1, 3)):
+                lines.append("   %03d   ****\n" % code)
+        resval = rand.randint(100, 999)
+        if rand.random() < identity_rate:
+            lines.append("   938   **** %03d\n" % resval)
+        lines.append("   938        %03d  %s\n" % (
+            resval, "FAIL" if rand.random() < sr_rate else "PASS"))
+        if len(lines) > 10000:
+            stream.writelines(lines)
+            lines.clear()
+    stream.writelines(lines)
+
+
+def best(repeat, func, *args, setup=None):
+    """
+    Return the fastest of repeat timed calls of func, and its result.
+    setup, if given, is called (untimed) before each call.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def lookups(sns, resvals):
+    for sn in sns:
+        esdsort.ser2pro(sn)
+    for resval in resvals:
+        esdsort.res2des(resval)
+
+
+def clear_lookups():
+    """
+    Empty the lookup caches, so the lookup stage times the range
+    search rather than cache hits left by parsing.
+    """
+    for filename in (esdsort.PROCESS_FILENAME, esdsort.DESIGN_FILENAME):
+        esdsort.load_range_table(filename).lookup.cache_clear()
+
+
+def run(sizes, repeat=3, processes=6, designs=6, **options):
+    """
+    Benchmark each size in a scratch directory, with serial numbers and
+    resistor values spread over processes and designs, returning
+    {size: {stage: seconds}}.
+    """
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory, \
+                chdir(directory):
+            write_tables(directory, processes, designs)
+            esdsort.load_range_table.cache_clear()
+            esdsort.load_failcodes.cache_clear()
+            with open("results.txt", "w") as stream:
+                generate(stream, size, **options)
+
+            timings = results[size] = {}
+            timings['parse'], result = best(
+                repeat, esdsort.parse_file, "results.txt")
+            part, part_count = result.part, result.part_count
+            timings['lookup'], _ = best(
+                repeat, lookups,
+                part.sn[1:part_count + 1], part.resval[1:part_count + 1],
+                setup=clear_lookups)
+            timings['aggregate'], summary = best(
+                repeat, esdsort.aggregate, part, part_count)
+            timings['write_fails'], _ = best(
+                repeat, esdsort.write_fails, part, part_count, io.StringIO())
+            timings['write_proc'], _ = best(
+                repeat, esdsort.write_proc, summary, io.StringIO())
+            timings['write_volt'], _ = best(
+                repeat, esdsort.write_volt, summary, io.StringIO())
+    return results
+
+
+@contextlib.contextmanager
+def chdir(directory):
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def report(results, baseline=None, tolerance=0.25, stream=sys.stdout):
+    """
+    Print the timings, with the ratio to baseline where there is one.
+    Return the (size, stage) pairs slower than baseline by more than
+    tolerance.
+    """
+    regressions = []
+    for size, timings in results.items():
+        recorded = (baseline or {}).get(str(size), {})
+        for stage in STAGES:
+            line = "%8d parts  %-12s %10.4fs" % (size, stage, timings[stage])
+            if stage in recorded:
+                ratio = timings[stage] / recorded[stage]
+                line += "  %5.2fx baseline" % ratio
+                if ratio > 1 + tolerance:
+                    line += "  REGRESSION"
+                    regressions.append((size, stage))
+            print(line, file=stream)
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark esdsort on synthetic result files.")
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=SIZES, metavar='PARTS',
+        help="part counts to benchmark (default: %(default)s)")
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="time each stage this many times, keeping the best")
+    parser.add_argument(
+        '--voltages', type=int, nargs='+', default=VOLTAGES, metavar='VOLTS')
+    parser.add_argument(
+        '--processes', type=int, default=6,
+        help="processes to spread serial numbers over (default: %(default)s)")
+    parser.add_argument(
+        '--designs', type=int, default=6,
+        help="designs to spread resistor values over (default: %(default)s)")
+    parser.add_argument('--fail-rate', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--save', metavar='FILE', help="record the timings as a baseline")
+    parser.add_argument(
+        '--compare', metavar='FILE', help="compare against a baseline")
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help="slowdown tolerated before flagging a regression "
+        "(default: %(default)s)")
+    parser.add_argument(
+        '--generate', metavar='PARTS', type=int,
+        help="just write a synthetic result file of this many parts "
+        "to stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.generate is not None:
+        generate(
+            sys.stdout, options.generate, options.voltages,
+            options.fail_rate, seed=options.seed)
+        return 0
+
+    results = run(
+        options.sizes, options.repeat, options.processes, options.designs,
+        voltages=options.voltages,
+        fail_rate=options.fail_rate, seed=options.seed)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as stream:
+            baseline = json.load(stream)['results']
+    regressions = report(results, baseline, options.tolerance)
+
+    if options.save:
+        with open(options.save, "w") as stream:
+            json.dump(
+                dict(
+                    python=platform.python_version(),
+                    machine=platform.machine(),
+                    processes=options.processes,
+                    designs=options.designs,
+                    results={str(size): timings for size, timings in results.items()},
+                ),
+                stream, indent=2, sort_keys=True)
+            stream.write("\n")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,27 +8,157 @@
  *                    written by Jason Coombs                             */
 """
 
+import io
+import os
+import bz2
+import gzip
+import lzma
+import re
 import sys
-import ctypes
+import csv
+import json
+import mmap
+import time
+import struct
+import pickle
+import sqlite3
+import queue
+import threading
+import fnmatch
+import array
+import bisect
+import asyncio
+import argparse
 import itertools
+import operator
 import functools
+import contextlib
+import collections
+import urllib.parse
+import concurrent.futures
 
-FAIL = 0
-PASS = 1
-MAXLINE = 100
-MAXPARTS = 3000
-MAXVOLTAGES = 10
-EOF = -1
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLOCKSIZE = 1 << 20
+"""Bytes read at a time from result streams that can't be mapped"""
+
+READAHEAD = 4
+"""Decompressed blocks a BackgroundReader may hold ready"""
+
+READER_POLL = 0.1
+"""Seconds a BackgroundReader blocks on a full queue before checking for close"""
+
+COMPRESSION = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+)
+"""Leading magic bytes of compressed result files, and their readers"""
 
 FF = 12
 """Character for form feed"""
 
-MAXNAME = 17
-"""Maximum length for process and design names"""
-
-buf = ''
+FAILTYPES = (
+    'icc', 'ipd', 'inph', 'inpl', 'iodh', 'iodl', 'iozh', 'iozl',
+    'odh', 'odl', 'ozh', 'ozl', 'cont',
+)
+"""Fail type counters kept for each part, in report column order"""
+
+ICC, IPD, INPH, INPL, IODH, IODL, IOZH, IOZL, ODH, ODL, OZH, OZL, CONT = \
+    range(len(FAILTYPES))
+
+FAILCODES = {
+    860: ICC, 881: ICC,
+    790: IPD, 813: IPD,
+    524: INPH,
+    544: INPL,
+    615: IODH,
+    634: IODL,
+    574: IOZH,
+    593: IOZL,
+    697: ODH,
+    716: ODL,
+    656: OZH,
+    675: OZL,
+    315: CONT,
+}
+"""Built-in map of tester fail codes to fail type columns"""
+
+IDENTITY_FAIL = 938
+"""Fail code of the identity test, logged to the status file"""
+
+VOLTAGE, SERIAL, FAILCODE, IDENTITY, STATUS = range(5)
+"""Kinds of record yielded by scan_records"""
+
+FAILS_HEADER = \
+    "SN     P  SR  ICC  IPD  INPH INPL IODH IODL IOZH IOZL ODH ODL OZH OZL CONT"
+
+FAILS_COLUMNS = tuple(
+    (' ' * (width - 1) + '%d', ' ' * width)
+    for width in (4, 5, 5, 5, 5, 5, 5, 5, 5, 4, 4, 4)
+) + (('     %d', '    '),)
+"""Filled and blank formats for each fail type column of results.fails"""
+
+WIDTH = 76
+"""Width of the report rules"""
+
+PAGE_LENGTH = 60
+"""Lines on a report page after which the next row starts a new page"""
+
+HEADER_LINES = 6
+"""Lines a page header counts for"""
+
+EXPORT_COLUMNS = (
+    'sn', 'voltage', 'process', 'design', 'resval', 'pass', 'sr',
+) + FAILTYPES
+"""Columns of the per-part export"""
+
+SUMMARY_COLUMNS = ('process', 'design', 'voltage', 'fails', 'total')
+"""Columns of the fail/total export, one row per cell"""
+
+LETTER_COLUMNS = frozenset(('process', 'design', 'pass', 'sr'))
+"""Export columns holding character codes, written as letters in text"""
+
+EXPORT_MAGIC = b'ESDX'
+EXPORT_VERSION = 1
+"""Signature and format version of .bin column exports"""
 
 OUTPUT_FILENAME = "esdsort.dat"
+PROCESS_FILENAME = "PROCESS.DAT"
+DESIGN_FILENAME = "DESIGN.DAT"
+FAILCODE_FILENAME = "FAILCODE.DAT"
+CHECKPOINT_FILENAME = "esdsort.ckp"
+
+CHECKPOINT_VERSION = 1
+"""Format version of the incremental checkpoint file"""
+
+RESULT_FILENAMES = (
+    "results.fails", "results.proc", "results.volt", "results.types")
+
+OWN_FILENAMES = frozenset((
+    OUTPUT_FILENAME, PROCESS_FILENAME, DESIGN_FILENAME, FAILCODE_FILENAME,
+    CHECKPOINT_FILENAME, CHECKPOINT_FILENAME + ".tmp",
+) + RESULT_FILENAMES)
+"""Files never treated as tester results when watching a directory"""
+
+SHARD_FORMAT = "esdsort-shard"
+SHARD_VERSION = 1
+"""Signature and format version of shard summary files"""
+
+RETEST_POLICIES = ('keep-first', 'keep-last', 'merge')
+"""Ways of resolving parts tested again at the same voltage"""
+
+STORE_BATCH = 10000
+"""Parts inserted per executemany call when filling a part store"""
+
+WATCH_INTERVAL = 0.5
+"""Seconds between polls of a watched directory"""
+
+WATCH_DEBOUNCE = 2.0
+"""Default seconds a watched directory must be quiet before updating"""
 
 banner = """
 
@@ -39,660 +169,2723 @@ banner = """
 """
 
 
+class PartTable:
+    """
+    Column-oriented storage for parsed parts.
+
+    Every field is a typed array indexed by part number. ``pass_``,
+    ``sr``, ``process`` and ``design`` hold character codes (0 when
+    unset), ``processname`` and ``designname`` index into ``names``,
+    and ``failtype`` is a row-major matrix holding one row of
+    ``len(FAILTYPES)`` counters per part. Index 0 is a scratch entry.
+
+    The arrays grow geometrically as parts are added (see reserve),
+    so appending is amortized constant time and there is no limit on
+    the number of parts.
+    """
+
+    columns = dict(
+        sn='l',
+        voltage='l',
+        pass_='B',
+        sr='B',
+        resval='l',
+        process='B',
+        design='B',
+        processname='H',
+        designname='H',
+    )
+
+    def __init__(self, capacity=1):
+        self.capacity = 0
+        for name, typecode in self.columns.items():
+            setattr(self, name, array.array(typecode))
+        self.failtype = array.array('H')
+        self.names = ['']
+        self._name_ids = {'': 0}
+        self.reserve(capacity - 1)
+
+    def reserve(self, index):
+        """
+        Make room for parts up to and including index.
+
+        >>> part = PartTable()
+        >>> part.reserve(20)
+        >>> part.capacity, len(part.fails(20))
+        (21, 13)
+        >>> part.reserve(21)
+        >>> part.capacity
+        42
+        """
+        if index < self.capacity:
+            return
+        capacity = max(index + 1, 2 * self.capacity)
+        extra = capacity - self.capacity
+        for name, typecode in self.columns.items():
+            getattr(self, name).extend(zeros(typecode, extra))
+        self.failtype.extend(zeros('H', extra * len(FAILTYPES)))
+        self.capacity = capacity
+
+    def trim(self, count):
+        """
+        Release the room reserved beyond the first count parts.
+        """
+        for name in self.columns:
+            del getattr(self, name)[count + 1:]
+        del self.failtype[(count + 1) * len(FAILTYPES):]
+        self.capacity = count + 1
+
+    def intern(self, name):
+        """
+        Return the index of name in ``names``, adding it if needed.
+        """
+        try:
+            return self._name_ids[name]
+        except KeyError:
+            self.names.append(name)
+            return self._name_ids.setdefault(name, len(self.names) - 1)
+
+    def set_processname(self, index, name):
+        self.processname[index] = self.intern(name)
+        self.process[index] = ord(name[0])
+
+    def set_designname(self, index, name):
+        self.designname[index] = self.intern(name)
+        self.design[index] = ord(name[0])
+
+    def get_processname(self, index):
+        return self.names[self.processname[index]]
+
+    def get_designname(self, index):
+        return self.names[self.designname[index]]
+
+    def fails(self, index):
+        """
+        Return the fail type counters for the part at index.
+        """
+        start = index * len(FAILTYPES)
+        return self.failtype[start:start + len(FAILTYPES)]
+
+    def count_fail(self, index, failtype):
+        self.failtype[index * len(FAILTYPES) + failtype] += 1
+
+    def clear_fails(self, index):
+        start = index * len(FAILTYPES)
+        self.failtype[start:start + len(FAILTYPES)] = zeros('H', len(FAILTYPES))
+
+    def extend(self, other, count, start):
+        """
+        Copy parts 1 through count of other into this table as parts
+        start + 1 through start + count.
+        """
+        stop = start + count + 1
+        self.reserve(stop - 1)
+        for name in self.columns:
+            getattr(self, name)[start + 1:stop] = getattr(other, name)[1:count + 1]
+        ids = [self.intern(name) for name in other.names]
+        for name in ('processname', 'designname'):
+            getattr(self, name)[start + 1:stop] = array.array(
+                'H', [ids[i] for i in getattr(other, name)[1:count + 1]])
+        width = len(FAILTYPES)
+        self.failtype[(start + 1) * width:stop * width] = \
+            other.failtype[width:(count + 1) * width]
+
+    def copy_part(self, index, other, source):
+        """
+        Make the part at index a copy of part source of other.
+        """
+        self.reserve(index)
+        for name in self.columns:
+            getattr(self, name)[index] = getattr(other, name)[source]
+        self.processname[index] = self.intern(other.get_processname(source))
+        self.designname[index] = self.intern(other.get_designname(source))
+        width = len(FAILTYPES)
+        self.failtype[index * width:(index + 1) * width] = \
+            other.failtype[source * width:(source + 1) * width]
+
+    def merge_part(self, index, other, source):
+        """
+        Fold part source of other, a retest, into the part at index:
+        fail counters are summed, the part fails if either test did,
+        and an identity line missing from one is taken from the other.
+
+        >>> part = PartTable()
+        >>> part.reserve(2)
+        >>> part.pass_[1], part.pass_[2] = ord('Y'), ord('N')
+        >>> part.count_fail(2, ICC)
+        >>> part.set_designname(2, 'B Design')
+        >>> part.merge_part(1, part, 2)
+        >>> chr(part.pass_[1]), part.fails(1)[ICC], part.get_designname(1)
+        ('N', 1, 'B Design')
+        """
+        for name in ('pass_', 'sr'):
+            bad = ord('N') if name == 'pass_' else ord('Y')
+            if getattr(other, name)[source] == bad:
+                getattr(self, name)[index] = bad
+        if not self.design[index] and other.design[source]:
+            self.resval[index] = other.resval[source]
+            self.design[index] = other.design[source]
+            self.designname[index] = self.intern(other.get_designname(source))
+        width = len(FAILTYPES)
+        for column in range(width):
+            self.failtype[index * width + column] += \
+                other.failtype[source * width + column]
+
+    def breakdown(self, name, count, vectorized=None):
+        """
+        Return the fail type counters of parts 1 through count summed
+        by the value of the named column (voltage, process or design
+        for instance), as a dict of value to a list of counters.
+        Process and design are keyed by letter. The reduction runs in
+        a single batch over the counter matrix, in NumPy when it is
+        available (or vectorized is true), else a column at a time.
+
+        >>> part = PartTable()
+        >>> part.reserve(3)
+        >>> for i, voltage in enumerate((500, 2000, 500), 1):
+        ...     part.voltage[i] = voltage
+        ...     part.count_fail(i, CONT)
+        >>> part.count_fail(3, ICC)
+        >>> totals = part.breakdown('voltage', 3, vectorized=False)
+        >>> totals[500][ICC], totals[500][CONT], totals[2000][CONT]
+        (1, 2, 1)
+
+        The NumPy reduction gives the same totals (skipped, showing
+        True, where NumPy isn't installed):
+
+        >>> numpy is None or part.breakdown('voltage', 3, True) == totals
+        True
+        """
+        if vectorized is None:
+            vectorized = numpy is not None
+        width = len(FAILTYPES)
+        if vectorized:
+            keys = self.as_numpy(name)[1:count + 1]
+            matrix = self.as_numpy('failtype')[1:count + 1]
+            values, inverse = numpy.unique(keys, return_inverse=True)
+            cells = inverse.reshape(-1, 1) * width + numpy.arange(width)
+            sums = numpy.bincount(
+                cells.ravel(), weights=matrix.ravel(),
+                minlength=len(values) * width,
+            ).astype(numpy.int64).reshape(-1, width)
+            totals = dict(zip(values.tolist(), sums.tolist()))
+            del keys, matrix
+        else:
+            keys = getattr(self, name)[1:count + 1]
+            columns = [
+                self.failtype[width + column:(count + 1) * width:width]
+                for column in range(width)
+            ]
+            totals = {}
+            for value in sorted(set(keys)):
+                mask = list(map(value.__eq__, keys))
+                totals[value] = [
+                    sum(itertools.compress(column, mask))
+                    for column in columns
+                ]
+        if name in ('process', 'design'):
+            totals = {chr(key): row for key, row in totals.items()}
+        return totals
+
+    def record(self, index):
+        """
+        Return the part at index as an immutable Part.
+        """
+        return Part(
+            self.sn[index],
+            self.voltage[index],
+            chr(self.pass_[index]),
+            chr(self.sr[index]),
+            self.resval[index],
+            chr(self.process[index]) if self.process[index] else '',
+            chr(self.design[index]) if self.design[index] else '',
+            self.get_processname(index),
+            self.get_designname(index),
+            tuple(self.fails(index)),
+        )
+
+    def as_numpy(self, name):
+        """
+        Return a zero-copy NumPy view of the named column (the
+        fail type matrix is shaped one row per part). Requires NumPy.
+        The table can't grow while a view is alive.
+        """
+        if name == 'failtype':
+            return numpy.frombuffer(self.failtype, dtype=numpy.uint16) \
+                .reshape(-1, len(FAILTYPES))
+        column = getattr(self, name)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+
+class Retests:
+    """
+    Hash index of parts by serial number and zap voltage, used to
+    resolve retests as parts are added to a PartTable. policy is one
+    of RETEST_POLICIES: keep-first drops a retest, keep-last replaces
+    the earlier test with it, and merge folds it in (see merge_part).
+    ``counts`` holds the number of retests of each (sn, voltage).
+
+    >>> other = PartTable()
+    >>> other.reserve(3)
+    >>> other.sn[1:4] = array.array('l', [12, 13, 12])
+    >>> other.resval[1:4] = array.array('l', [100, 200, 300])
+    >>> part = PartTable()
+    >>> retests = Retests('keep-last')
+    >>> retests.add(part, 0, other, 3)
+    2
+    >>> part.resval[1], part.resval[2], dict(retests.counts)
+    (300, 200, {(12, 0): 1})
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.index = {}
+        self.counts = collections.Counter()
+
+    def add(self, part, part_count, other, count):
+        """
+        Add parts 1 through count of other to part, after the first
+        part_count, resolving retests; return the new part count.
+        """
+        for source in range(1, count + 1):
+            key = other.sn[source], other.voltage[source]
+            index = self.index.get(key)
+            if index is None:
+                part_count += 1
+                part.copy_part(part_count, other, source)
+                self.index[key] = part_count
+                continue
+            self.counts[key] += 1
+            if self.policy == 'keep-last':
+                part.copy_part(index, other, source)
+            elif self.policy == 'merge':
+                part.merge_part(index, other, source)
+        return part_count
+
+    def report(self, statfile):
+        """
+        Write the retest counts to the status file.
+        """
+        for (sn, voltage), count in sorted(self.counts.items()):
+            print(
+                "Retest of sn%d zapped at %d volts: %d duplicate%s"
+                % (sn, voltage, count, "s" if count > 1 else ""),
+                file=statfile)
+        print(
+            "%d duplicate tests of %d parts resolved by %s.\n"
+            % (sum(self.counts.values()), len(self.counts), self.policy),
+            file=statfile)
+
+
+def zeros(typecode, length):
+    """
+    Return a typed array of length zeros.
+
+    >>> zeros('H', 3)
+    array('H', [0, 0, 0])
+    """
+    return array.array(typecode, bytes(array.array(typecode).itemsize * length))
+
+
+class Dimension:
+    """
+    Registry of the distinct values of one report dimension (voltage,
+    process or design), each interned to a dense integer id in the
+    order first seen, along with the name it was first seen with.
+
+    >>> processes = Dimension()
+    >>> processes.intern('B', 'B Process'), processes.intern('A', 'A Process')
+    (0, 1)
+    >>> processes.intern('B', 'B Other'), processes.names
+    (0, ['B Process', 'A Process'])
+    >>> processes.sorted()
+    [1, 0]
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+        self.names = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value, name=None):
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.values.append(value)
+            self.names.append(name)
+            return self.ids.setdefault(value, len(self.values) - 1)
+
+    def sorted(self):
+        """
+        Return the ids ordered by value.
+        """
+        return sorted(range(len(self.values)), key=self.values.__getitem__)
+
+    def remap(self, other):
+        """
+        Intern the values of other, returning a list that maps its
+        ids to ids in this dimension.
+        """
+        return list(map(self.intern, other.values, other.names))
+
+
+class Summary:
+    """
+    Fail and total counts for each (process, design, voltage) cell,
+    folded one part at a time. ``cells`` is keyed by the dense ids of
+    the ``processes``, ``designs`` and ``voltages`` dimensions, so it
+    holds only the combinations actually seen. Created with failtypes,
+    it also sums the fail type counters of each cell in ``failtypes``
+    (otherwise None).
+    """
+
+    def __init__(self, failtypes=False):
+        self.processes = Dimension()
+        self.designs = Dimension()
+        self.voltages = Dimension()
+        self.cells = {}
+        self.failtypes = {} if failtypes else None
+
+    def add(
+            self, process, design, voltage, failed, processname, designname,
+            counters=None):
+        key = (
+            self.processes.intern(process, processname),
+            self.designs.intern(design, designname),
+            self.voltages.intern(voltage),
+        )
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = [0, 0]
+        cell[0] += failed
+        cell[1] += 1
+        if counters is not None and self.failtypes is not None:
+            self._add_failtypes(key, counters)
+
+    def _add_failtypes(self, key, counters):
+        row = self.failtypes.get(key)
+        if row is None:
+            row = self.failtypes[key] = [0] * len(FAILTYPES)
+        row[:] = map(operator.add, row, counters)
+
+    def add_part(self, part, index):
+        """
+        Fold in the part at index of a PartTable. Parts without a
+        design (no identity line) appear in none of the matrices.
+        """
+        if not part.design[index]:
+            return
+        self.add(
+            chr(part.process[index]),
+            chr(part.design[index]),
+            part.voltage[index],
+            part.pass_[index] == ord('N'),
+            part.get_processname(index),
+            part.get_designname(index),
+            part.fails(index) if self.failtypes is not None else None,
+        )
+
+    def update(self, other):
+        """
+        Fold in the counts of other, a Summary of parts that came after
+        the ones in this one.
+        """
+        processes = self.processes.remap(other.processes)
+        designs = self.designs.remap(other.designs)
+        voltages = self.voltages.remap(other.voltages)
+        for (process, design, voltage), (fails, total) in other.cells.items():
+            key = processes[process], designs[design], voltages[voltage]
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = self.cells[key] = [0, 0]
+            cell[0] += fails
+            cell[1] += total
+        if self.failtypes is not None and other.failtypes is not None:
+            for (process, design, voltage), counters in \
+                    other.failtypes.items():
+                self._add_failtypes(
+                    (processes[process], designs[design], voltages[voltage]),
+                    counters)
+
+    def format_cell(self, key, width):
+        """
+        Return "fails/total" for the cell with the given key, padded to
+        width, or blanks for an empty cell.
+
+        >>> summary = Summary()
+        >>> summary.add('A', 'B', 2000, True, 'A Process', 'B Design')
+        >>> summary.format_cell((0, 0, 0), 7)
+        ' 1/ 1  '
+        >>> summary.format_cell((0, 1, 0), 7)
+        '       '
+        """
+        cell = self.cells.get(key)
+        if cell is None:
+            return ' ' * width
+        return "%2d/%2d" % tuple(cell) + ' ' * (width - 5)
+
+
+def aggregate(part, part_count):
+    """
+    Fold parts 1 through part_count into a Summary.
+    """
+    summary = Summary()
+    for i in range(1, part_count + 1):
+        summary.add_part(part, i)
+    return summary
+
+
+class Stats:
+    """
+    Wall and CPU time per stage of a run, plus counters (lines scanned,
+    parts parsed, bytes read, table lookups and cache hits, and bytes
+    written to each output file as ``bytes_written:<file>``), for
+    --stats.
+
+    >>> stats = Stats()
+    >>> with stats.stage('parse'):
+    ...     stats.counters['parts'] += 2
+    >>> sorted(stats.as_dict()['stages']['parse']), stats.counters['parts']
+    (['cpu', 'wall'], 2)
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.record(
+                name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def record(self, name, wall, cpu):
+        timing = self.stages.setdefault(name, dict(wall=0.0, cpu=0.0))
+        timing['wall'] += wall
+        timing['cpu'] += cpu
+
+    def wrote(self, filename, size=None):
+        """
+        Count size bytes (by default, the file's size) written to
+        filename.
+        """
+        if size is None:
+            size = os.path.getsize(filename)
+        self.counters['bytes_written:' + filename] += size
+
+    def as_dict(self):
+        return dict(
+            elapsed=time.perf_counter() - self.start,
+            stages=self.stages,
+            counters=dict(self.counters),
+        )
+
+    def save(self, filename):
+        with open(filename, "w") as statsfile:
+            json.dump(self.as_dict(), statsfile, indent=2, sort_keys=True)
+            statsfile.write("\n")
+
+
+def lookup_counts():
+    """
+    Return a Counter of PROCESS.DAT and DESIGN.DAT lookups made so far
+    in this process, and how many were answered from the cache.
+    """
+    counts = collections.Counter()
+    for filename in (PROCESS_FILENAME, DESIGN_FILENAME):
+        table = load_range_table(filename)
+        if table is not None:
+            info = table.lookup.cache_info()
+            counts['lookups'] += info.hits + info.misses
+            counts['lookup_hits'] += info.hits
+    return counts
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="esdsort",
+        description="ESD data file sorting utility",
+    )
+    parser.add_argument('filenames', nargs='*', metavar='file')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help="parse input files in up to this many worker processes "
+        "(0 for one per CPU)",
+    )
+    parser.add_argument(
+        '-k', '--readers', type=int, metavar='K',
+        help="read up to K input files at once, skipping any that "
+        "can't be read instead of stopping",
+    )
+    parser.add_argument(
+        '-w', '--watch', metavar='DIR',
+        help="keep running, regenerating the reports whenever result "
+        "files in DIR are added or changed",
+    )
+    parser.add_argument(
+        '--pattern', default='*',
+        help="only watch files matching this glob pattern (default: *)",
+    )
+    parser.add_argument(
+        '--debounce', type=float, default=WATCH_DEBOUNCE, metavar='SECONDS',
+        help="wait until files in the watched directory have been quiet "
+        "this long before updating (default: %(default)s)",
+    )
+    parser.add_argument(
+        '-i', '--incremental', action='store_true',
+        help="resume from the parser state saved in %s by the last "
+        "incremental run, reading only what was appended to each file"
+        % CHECKPOINT_FILENAME,
+    )
+    parser.add_argument(
+        '-b', '--breakdown', action='store_true',
+        help="also write results.types, the fail type counts by "
+        "voltage, process and design",
+    )
+    parser.add_argument(
+        '-s', '--summary-only', action='store_true',
+        help="write only results.proc and results.volt, folding each "
+        "part into the counts as it is parsed instead of keeping it",
+    )
+    parser.add_argument(
+        '--dedup', choices=RETEST_POLICIES, metavar='POLICY',
+        help="count a part tested again at the same voltage once, "
+        "keeping its first test, its last, or merging their fails "
+        "(%s); retests are listed in %s"
+        % (', '.join(RETEST_POLICIES), OUTPUT_FILENAME),
+    )
+    parser.add_argument(
+        '--store', metavar='DB',
+        help="save the parsed parts in the SQLite database DB, skipping "
+        "files it already holds unchanged, and write the reports from "
+        "every part in it (files may then be omitted)",
+    )
+    parser.add_argument(
+        '--export', metavar='FILE',
+        help="also write the parsed parts to FILE, as CSV, JSON Lines, "
+        "packed binary columns or NumPy arrays by its extension (%s)"
+        % ', '.join(EXPORT_FORMATS),
+    )
+    parser.add_argument(
+        '--export-summary', metavar='FILE',
+        help="also write the fail/total counts of each process, design "
+        "and voltage to FILE, in the same formats",
+    )
+    parser.add_argument(
+        '--stats', metavar='FILE',
+        help="write per-stage wall and CPU times and counters (lines, "
+        "parts, bytes, lookups) to FILE as JSON",
+    )
+    options = parser.parse_args(argv[1:])
+    if options.watch:
+        ignored = [
+            flag for flag, value in (
+                ("file names", options.filenames),
+                ("--incremental", options.incremental),
+                ("--readers", options.readers),
+                ("--dedup", options.dedup),
+                ("--store", options.store),
+                ("--export", options.export),
+                ("--export-summary", options.export_summary),
+                ("--stats", options.stats),
+                ("--breakdown", options.breakdown),
+            ) if value
+        ]
+        if ignored:
+            parser.error(
+                "--watch can't be combined with %s" % ", ".join(ignored))
+    if options.summary_only and (
+            options.incremental or options.readers or options.store
+            or options.export or options.watch or options.dedup
+            or options.breakdown):
+        parser.error(
+            "--summary-only can't be combined with --incremental, "
+            "--readers, --store, --export, --watch, --dedup or "
+            "--breakdown")
+    if options.jobs < 0:
+        parser.error("--jobs must be 0 or more")
+    if options.readers is not None:
+        if options.readers < 1:
+            parser.error("--readers must be at least 1")
+        if options.incremental or options.jobs != 1:
+            parser.error(
+                "--readers can't be combined with --incremental or --jobs")
+    for filename in (options.export, options.export_summary):
+        if filename is None:
+            continue
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in EXPORT_FORMATS:
+            parser.error("can't tell the export format of %s" % filename)
+        if extension == '.npz' and numpy is None:
+            parser.error("NumPy is needed to export %s" % filename)
+    return options
+
+
 def main(argc, argv):
-    class Type:
-        icc = 0
-        ipd = 0
-        inph = 0
-        inpl = 0
-        iodh = 0
-        iodl = 0
-        iozh = 0
-        iozl = 0
-        odh = 0
-        odl = 0
-        ozh = 0
-        ozl = 0
-        cont = 0
-
-    class Part:
-        sn = 0
-        voltage = 0
-        pass_ = chr(0)
-        sr = chr(0)
-        resval = 0
-        design = chr(0)
-        process = chr(0)
-
-        def __init__(self):
-            self.processname = ctypes.create_string_buffer(MAXNAME)
-            self.designname = ctypes.create_string_buffer(MAXNAME)
-            self.failtype = Type()
-
-    part = [Part() for _ in range(MAXPARTS)]
-
-    tempstring = []
-    propage = ''
-    despage = ''
-
-    position = 0
+    commands = dict(query=query, summarize=summarize, merge=merge)
+    if argc > 1 and argv[1] in commands:
+        sys.exit(commands[argv[1]](argv[2:argc]))
+
+    part = PartTable()
+
     part_count = 0
-    count = 0
-    failcode = 0
-    i = 0
-    e = 0
-    save = 0
-    paglen = 0
-    newdes = 0
-    voltages = [None] * MAXVOLTAGES
-    total = [None] * 30
-    fails = [None] * 30
-
-    # files
-    infile = statfile = resultfile = None
+
+    stats = Stats()
 
     print(banner)
     truncate(OUTPUT_FILENAME)
+    with stats.stage('tables'):
+        load_tables()
+
+    options = parse_args(argv[:argc])
+    summary = Summary()
+    failed = []
+    retests = Retests(options.dedup) if options.dedup else None
 
-    if argc == 1:
+    if options.watch:
+        watch(options.watch, options.pattern, options.debounce, options.jobs)
+    elif not options.filenames and not options.store:
         print(
             "Please re-enter command line with the name "
             "of the file to be sorted.",
             file=sys.stderr)
+    elif options.store:
+        try:
+            store = PartStore(options.store)
+            store.create()
+        except sqlite3.Error as exc:
+            print(
+                "Cannot open part store %s: %s" % (options.store, exc),
+                file=sys.stderr)
+            sys.exit(1)
+        with contextlib.closing(store):
+            with stats.stage('parse'):
+                count_parts(
+                    options.filenames, PartTable(), 0, Summary(),
+                    options.jobs, options.incremental, stats, store,
+                    options.readers, failed)
+            with stats.stage('store'):
+                if retests is None:
+                    part_count = store.load(part)
+                else:
+                    stored = PartTable()
+                    part_count = retests.add(
+                        part, 0, stored, store.load(stored))
+                summary = aggregate(part, part_count)
+                with open(OUTPUT_FILENAME, "w") as statfile:
+                    statfile.write(store.status())
+                    if retests is not None:
+                        retests.report(statfile)
     else:
-        part_count = count_parts(argc, argv, part, part_count, tempstring)
+        with stats.stage('parse'):
+            part_count = count_parts(
+                options.filenames, part, part_count, summary,
+                options.jobs, options.incremental, stats, None,
+                options.readers, failed, options.summary_only, retests)
 
     if part_count > 0:
         print("Total parts: %d" % part_count)
+        failed += make_result_files(
+            part, part_count, summary, stats, options.jobs,
+            not options.summary_only, options.breakdown)
+        exports = (
+            (options.export, part_columns, (part, part_count)),
+            (options.export_summary, summary_columns, (summary,)),
+        )
+        for filename, columns, args in exports:
+            if filename is None:
+                continue
+            try:
+                with stats.stage('export'):
+                    export(filename, columns(*args))
+                stats.wrote(filename)
+            except OSError:
+                print(
+                    "\nCannot open output file %s." % filename,
+                    file=sys.stderr)
+                failed.append(filename)
+
+    if options.stats:
+        stats.wrote(OUTPUT_FILENAME)
+        stats.save(options.stats)
+    if failed:
+        sys.exit(1)
+
+
+def parse_query_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="esdsort query",
+        description="Answer questions from the aggregate index of a "
+        "part store (see --store), without reparsing.",
+    )
+    parser.add_argument('store', metavar='DB')
+    parser.add_argument(
+        '-p', '--process', action='append', metavar='LETTER',
+        help="only this process (may be repeated)")
+    parser.add_argument(
+        '-d', '--design', action='append', metavar='LETTER',
+        help="only this design (may be repeated)")
+    parser.add_argument(
+        '-v', '--voltage', action='append', type=parse_voltage,
+        metavar='VOLTS', help="only this zap voltage, as 2000 or 2KV "
+        "(may be repeated)")
+    parser.add_argument(
+        '--since', type=parse_date, metavar='YYYY-MM-DD',
+        help="only files last modified on or after this date")
+    parser.add_argument(
+        '--until', type=parse_date, metavar='YYYY-MM-DD',
+        help="only files last modified before this date")
+    parser.add_argument(
+        '--by', nargs='+', default=[],
+        choices=('process', 'design', 'voltage'),
+        help="one line for each combination of these")
+    parser.add_argument(
+        '-f', '--failtypes', action='store_true',
+        help="break the fails down by fail type")
+    parser.add_argument(
+        '--sn', type=int,
+        help="list every stored test of this serial number instead")
+    return parser.parse_args(argv)
+
+
+def parse_voltage(text):
+    """
+    >>> parse_voltage('2KV'), parse_voltage('500V'), parse_voltage('750')
+    (2000, 500, 750)
+    """
+    text = text.upper().rstrip('V')
+    if text.endswith('K'):
+        return int(float(text[:-1]) * 1000)
+    return int(text)
 
-        #              Make Result Files                   #
 
-        try:
-            resultfile = open("results.fails", "w")
-        except Exception:
-            resultfile = None
-        if resultfile is None:
-            print(
-                "\nCannot open output file as %s." % "results.fails",
-                file=sys.stderr,
-            )
-            sys.exit(1)
-        else:
-            header = \
-                "SN     P  SR  ICC  IPD  INPH INPL IODH IODL IOZH IOZL ODH ODL OZH OZL CONT"
-            print("\nCreating result files.")
-            pagelen = save = 0
-
-            position = 1
-            while position <= part_count:
-                if part[position].voltage != part[save].voltage:
-                    save = position
-                    propage = 'A'
-
-                while propage < 'M':
-                    despage = 'A'
-
-                    for i in range(part_count):
-                        if part[i].voltage == part[save].voltage and \
-                                part[i].process == propage:
-                            while despage < 'M':
-                                newdes = 'Y'
-                                for e in range(part_count):
-
-                                    if paglen > 60 or pagelen == 0:
-                                        print(
-                                            "%c\n%dV\n%s" %
-                                            (FF, part[save].voltage, header),
-                                            file=resultfile,
-                                        )
-                                        for count in range(76):
-                                            print('=', end='', file=resultfile)
-                                        print(
-                                            "\n%s" % part[i].processname,
-                                            file=resultfile,
-                                        )
-                                        paglen = 6
-                                    if (
-                                        part[e].voltage == part[save].voltage and
-                                        part[e].process == propage and
-                                        part[e].design == despage
-                                    ):
-                                        if newdes == 'Y':
-                                            print(file=resultfile)
-                                            paglen += 1
-                                            newdes = 'N'
-                                        pagelen += 1
-                                    print(
-                                        "%c %4d %c  %c" % (
-                                            part[e].design, part[e].sn,
-                                            part[e].pass_, part[e].sr,
-                                            ),
-                                        end='',
-                                        file=resultfile,
-                                    )
-                                    if part[e].failtype.icc > 0:
-                                        print(
-                                            "   %d" % part[e].failtype.icc,
-                                            file=resultfile,
-                                            end='',
-                                        )
-                                    else:
-                                        print("    ", file=resultfile, end='')
-                                    if part[e].failtype.ipd > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.ipd,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.inph > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.inph,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.inpl > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.inpl,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.iodh > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.iodh,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.iodl > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.iodl,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.iozh > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.iozh,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.iozl > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.iozl,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.odh > 0:
-                                        print(
-                                            "    %d" % part[e].failtype.odh,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("     ", file=resultfile, end='')
-                                    if part[e].failtype.odl > 0:
-                                        print(
-                                            "   %d" % part[e].failtype.odl,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("    ", file=resultfile, end='')
-                                    if part[e].failtype.ozh > 0:
-                                        print(
-                                            "   %d" % part[e].failtype.ozh,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("    ", file=resultfile, end='')
-                                    if part[e].failtype.ozl > 0:
-                                        print(
-                                            "   %d" % part[e].failtype.ozl,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("    ", file=resultfile, end='')
-                                    if part[e].failtype.cont > 0:
-                                        print(
-                                            "     %d" % part[e].failtype.cont,
-                                            file=resultfile,
-                                        )
-                                    else:
-                                        print("    \n", file=resultfile, end='')
-                                despage += 1
-
-                    paglen = 0
-                    propage += 1
-                position += 1
-            resultfile.close()
-
-        position = 1
-        while position <= part_count:
-            for count in range(MAXVOLTAGES):
-                if part[position].voltage == voltages[count]:
-                    break
-                if voltages[count] == 0:
-                    voltages[count] = part[position].voltage
-                    break
-            position += 1
+def parse_date(text):
+    """
+    Return the local midnight starting the date text, in nanoseconds.
+    """
+    return int(time.mktime(time.strptime(text, '%Y-%m-%d'))) * 10**9
 
-        try:
-            resultfile = open("results.proc", "w")
-        except Exception:
-            resultfile = None
-        if resultfile is None:
+
+def query(argv, output=sys.stdout):
+    """
+    Run ``esdsort query``, returning the exit status.
+    """
+    options = parse_query_args(argv)
+    if not os.path.isfile(options.store):
+        print("Cannot open part store %s." % options.store, file=sys.stderr)
+        return 1
+    try:
+        store = PartStore(options.store, readonly=True)
+        with contextlib.closing(store):
+            if options.sn is not None:
+                found = store.find(options.sn)
+            else:
+                rows = store.totals(
+                    options.by, process=options.process,
+                    design=options.design, voltage=options.voltage,
+                    since=options.since, until=options.until)
+    except sqlite3.Error as exc:
+        print(
+            "Cannot read part store %s: %s" % (options.store, exc),
+            file=sys.stderr)
+        return 1
+
+    if options.sn is not None:
+        for path, record in found:
+            row = format_fails_row(
+                ord(record.design or ' '), record.sn,
+                ord(record.pass_ or ' '), ord(record.sr or ' '),
+                record.failtype)
             print(
-                "\nCannot open output file %s." % "results.proc",
-                file=sys.stderr,
-                end='',
-            )
-            sys.exit(1)
-        else:
-            propage = 'A'
-            while propage < 'M':
-                paglen = 0
-                despage = 'A'
-                while despage < 'M':
-                    count = 1
-                    while count <= part_count:
-                        position = 0
-                        while voltages[position] != 0:
-                            total[position] = fails[position] = 0
-                            if (
-                                part[count].process == propage
-                                and part[count].design == despage
-                            ):
-                                if paglen == 0 or paglen > 60:
-                                    paglen = 6
-                                    print(
-                                        "%c\nPROCESS %s\n           DESIGN    " %
-                                        (FF, part[count].processname),
-                                        file=resultfile,
-                                        end='',
-                                    )
-                                    i = 0
-                                    while voltages[i] != 0:
-                                        print(
-                                            "%3.1fKV  " % voltages[i]/1000,
-                                            file=resultfile,
-                                            end='',
-                                        )
-                                        i += 1
-                                    print(file=resultfile)
-                                    for i in range(76):
-                                        print('=', file=resultfile, end='')
-                                    print("\n", file=resultfile)
-
-                                e = 1
-                                while e < part_count:
-                                    if (
-                                        part[e].process == propage
-                                        and part[e].design == despage
-                                        and part[e].voltage == voltages[position]
-                                    ):
-                                        total[position] += 1
-                                        if part[e].pass_ == 'N':
-                                            fails[position] += 1
-                                    e += 1
-                            position += 1
-                        if (
-                            part[count].design == despage
-                            and part[count].process == propage
-                        ):
-
-                            print(
-                                "%17s    " % part[count].designname,
-                                file=resultfile,
-                                end='',
-                            )
-                            position = 0
-                            while voltages[position] != 0:
-                                if total[position] != 0:
-                                    print(
-                                        "%2d/%2d  " %
-                                        (fails[position], total[position]),
-                                        file=resultfile,
-                                        end='',
-                                    )
-                                else:
-                                    print("       ", file=resultfile, end='')
-                                position += 1
-                            print(file=resultfile)
-                            for i in range(76):
-                                print("_", file=resultfile, end='')
-                            print("\n", file=resultfile)
-                            paglen = paglen + 3
-                            break
-                        count += 1
-                    despage = chr(ord(despage) + 1)
-                propage = chr(ord(propage) + 1)
-            resultfile.close()
+                "%s  %dV  %s" % (path, record.voltage, row),
+                file=output, end='')
+        return 0
+
+    width = len(options.by)
+    header = ["%-8s" % name.upper() for name in options.by]
+    header.append("  FAILS   TOTAL   RATE")
+    if options.failtypes:
+        header.extend("%6s" % name.upper() for name in FAILTYPES)
+    print(''.join(header), file=output)
+    for row in rows:
+        fields = ["%-8s" % value for value in row[:width]]
+        fails, total = row[width:width + 2]
+        fields.append("%7d %7d %5.1f%%" % (fails, total, 100.0 * fails / total))
+        if options.failtypes:
+            fields.extend("%6d" % count for count in row[width + 2:])
+        print(''.join(fields), file=output)
+    return 0
+
+
+def parse_summarize_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="esdsort summarize",
+        description="Fold result files into a shard summary that "
+        "esdsort merge can combine with others.",
+    )
+    parser.add_argument('filenames', nargs='+', metavar='file')
+    parser.add_argument(
+        '-o', '--output', required=True, metavar='SHARD',
+        help="write the shard summary here")
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help="parse input files in up to this many worker processes "
+        "(0 for one per CPU)")
+    options = parser.parse_args(argv)
+    if options.jobs < 0:
+        parser.error("--jobs must be 0 or more")
+    return options
+
+
+def summarize(argv):
+    """
+    Run ``esdsort summarize``, returning the exit status.
+    """
+    options = parse_summarize_args(argv)
+    print(banner)
+    truncate(OUTPUT_FILENAME)
+    load_tables()
+    summary = Summary(failtypes=True)
+    part_count = count_parts(
+        options.filenames, PartTable(), 0, summary, options.jobs,
+        summary_only=True)
+    try:
+        save_shard(options.output, summary, part_count)
+    except OSError:
+        print(
+            "\nCannot open output file %s." % options.output,
+            file=sys.stderr)
+        return 1
+    print("Total parts: %d" % part_count)
+    print("Shard summary written to %s." % options.output)
+    return 0
+
+
+def parse_merge_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="esdsort merge",
+        description="Combine shard summaries, in order, and write "
+        "results.proc and results.volt from them.",
+    )
+    parser.add_argument('shards', nargs='+', metavar='SHARD')
+    parser.add_argument(
+        '-o', '--output', metavar='SHARD',
+        help="also write the combined counts as a shard, to merge further")
+    return parser.parse_args(argv)
+
+
+def merge(argv):
+    """
+    Run ``esdsort merge``, returning the exit status.
 
+    Merging is associative: merging shards a and b, then the result
+    with c, gives the same counts, dimension order and reports as
+    merging a with the merge of b and c, or all three at once.
+    """
+    options = parse_merge_args(argv)
+    print(banner)
+    summary = Summary(failtypes=True)
+    part_count = 0
+    for filename in options.shards:
         try:
-            resultfile = open("results.volt", "w")
-        except Exception:
-            resultfile = None
-
-        if resultfile is None:
+            shard, count = load_shard(filename)
+        except (OSError, ValueError, KeyError, TypeError) as exc:
             print(
-                "\nCannot open output file %s." % "results.volt",
-                file=sys.stderr,
-                end='',
-            )
-            sys.exit(1)
-        else:
-            position = 0
-            while voltages[position] != 0:
-                paglen = 0
-                despage = 'A'
-                while despage < 'M':
-                    count = 1
-                    while count <= part_count:
-                        propage = 'A'
-                        while propage < 'M':
-                            total[propage - ord('A')] = fails[propage - ord('A')] = 0
-                            if (
-                                part[count].voltage == voltages[position]
-                                and part[count].design == despage
-                            ):
-                                if paglen == 0 or paglen > 60:
-                                    paglen = 6
-
-                                    print(
-                                        "%c\nVOLTAGE %4d\t\t\tPROCESS\n           DESIGN   " %
-                                        (FF, voltages[position]),
-                                        file=resultfile,
-                                        end='',
-                                    )
-                                    i = 'A'
-                                    while i < 'M':
-                                        if i == 'L':
-                                            print(
-                                                i,
-                                                file=resultfile,
-                                                end='',
-                                            )
-                                        else:
-                                            print(
-                                                "%c       " % i,
-                                                file=resultfile,
-                                                end='',
-                                            )
-                                        i = chr(ord(i) + 2)
-                                    print(
-                                        "\n                 ",
-                                        file=resultfile,
-                                        end='',
-                                    )
-                                    i = 'B'
-                                    while i < 'N':
-                                        print(
-                                            "       %c" % i,
-                                            file=resultfile,
-                                            end='',
-                                        )
-                                        i = chr(ord(i) + 2)
-                                    print(file=resultfile)
-                                    for i in range(76):
-                                        print("=", file=resultfile, end="")
-                                    print("\n", file=resultfile)
-
-                                e = 1
-                                while e <= part_count:
-                                    if (
-                                        part[e].process == propage
-                                        and part[e].design == despage
-                                        and part[e].voltage == voltages[position]
-                                    ):
-                                        total[propage-ord('A')] += 1
-                                        if part[e].pass_ == 'N':
-                                            fails[propage-ord('A')] += 1
-                                    e += 1
-                            propage = chr(ord(propage) + 1)
-                        if (
-                            part[count].design == despage
-                            and part[count].voltage == voltages[position]
-                        ):
-
-                            print(
-                                "%17s   " % part[count].designname,
-                                file=resultfile,
-                                end='',
-                            )
-                            propage = 'A'
-                            while propage < 'M':
-                                if total[propage-ord('A')] != 0:
-                                    print(
-                                        "%2d/%2d   " % (
-                                            fails[propage-ord('A')],
-                                            total[propage-ord('A')],
-                                        ),
-                                        file=resultfile,
-                                        end='',
-                                    )
-                                else:
-                                    print("        ", file=resultfile, end='')
-                                propage = chr(ord(propage) + 2)
-
-                            print(
-                                "\n                        ",
-                                file=resultfile,
-                                end="",
-                            )
-                            propage = 'B'
-                            while propage < 'N':
-                                if total[propage-ord('A')] != 0:
-                                    print(
-                                        "%2d/%2d   " % (
-                                            fails[propage-ord('A')],
-                                            total[propage-ord('A')],
-                                        ),
-                                        file=resultfile,
-                                        end='',
-                                    )
-                                else:
-                                    print("        ", file=resultfile, end="")
-                                propage = chr(ord(propage) + 2)
-                            print(file=resultfile)
-                            for i in range(76):
-                                print("_", file=resultfile, end="")
-                            print("\n", file=resultfile)
-                            paglen = paglen + 3
-                            break
-                        count += 1
-                    despage = chr(ord(despage) + 1)
-                position += 1
-            resultfile.close()
-
-
-def count_parts(argc, argv, part, part_count, tempstring):
-    while True:
-        argc -= 1
-        if argc == 0:
-            break
-        argv = argv[1:]
+                "Cannot read shard summary %s: %s" % (filename, exc),
+                file=sys.stderr)
+            return 1
+        summary.update(shard)
+        part_count += count
+    print("Total parts: %d" % part_count)
+    failed = make_result_files(None, part_count, summary, fails=False)
+    if options.output:
         try:
-            infile = open(argv[0])
-        except Exception:
+            save_shard(options.output, summary, part_count)
+        except OSError:
             print(
-                "Can't open %s.\nPlease check path and filename."
-                % argv[0],
+                "\nCannot open output file %s." % options.output,
                 file=sys.stderr)
-            sys.exit(1)
+            failed.append(options.output)
+    return 1 if failed else 0
+
+
+def load_tables():
+    """
+    Load the lookup tables afresh, warning of overlapping ranges and
+    exiting if the fail code table is malformed.
+    """
+    try:
+        reload_tables()
+    except ValueError as exc:
+        print("%s: %s" % (FAILCODE_FILENAME, exc), file=sys.stderr)
+        sys.exit(1)
+
+
+def reload_tables():
+    """
+    Load the lookup tables afresh, warning of overlapping ranges. If
+    the fail code table is malformed, raise ValueError and keep the
+    tables already loaded.
+    """
+    try:
+        with open(FAILCODE_FILENAME, "r") as init:
+            parse_failcodes(init)
+    except OSError:
+        pass
+    load_range_table.cache_clear()
+    load_failcodes.cache_clear()
+    report_overlaps(PROCESS_FILENAME)
+    report_overlaps(DESIGN_FILENAME)
+    load_failcodes(FAILCODE_FILENAME)
+
+
+def make_result_files(
+        part, part_count, summary, stats=None, jobs=1, fails=True,
+        types=False):
+    """
+    Write results.fails, results.proc and results.volt concurrently,
+    each in its own thread, or with jobs other than 1 in its own worker
+    process (given a copy of the parts and Summary). A report that
+    can't be written is reported and the others are still written;
+    the names of those that failed are returned. results.fails is left
+    out unless fails is true, and results.types written only if types
+    is.
+    """
+    stats = stats or Stats()
+    reports = (
+        ("results.fails", write_fails, (part, part_count)),
+        ("results.proc", write_proc, (summary,)),
+        ("results.volt", write_volt, (summary,)),
+    )[0 if fails else 1:]
+    if types:
+        reports += (("results.types", write_types, (part, part_count)),)
+    if jobs == 1:
+        pool = concurrent.futures.ThreadPoolExecutor(len(reports))
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(len(reports))
+
+    print("\nCreating result files.")
+    failed = []
+    with pool:
+        futures = [
+            pool.submit(write_report, filename, writer, *args)
+            for filename, writer, args in reports
+        ]
+        for (filename, writer, args), future in zip(reports, futures):
+            result = future.result()
+            if isinstance(result, OSError):
+                print(
+                    "\nCannot open output file %s." % filename,
+                    file=sys.stderr)
+                failed.append(filename)
+                continue
+            wall, cpu, size = result
+            stats.record(writer.__name__, wall, cpu)
+            stats.wrote(filename, size)
+    return failed
+
+
+def write_report(filename, writer, *args):
+    """
+    Write one report with writer(*args, resultfile), returning its
+    wall and CPU time and size, or the OSError that stopped it.
+    """
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        with open(filename, "w") as resultfile:
+            writer(*args, resultfile)
+            size = resultfile.tell()
+    except OSError as exc:
+        return exc
+    return time.perf_counter() - wall, time.thread_time() - cpu, size
+
+
+def watch(directory, pattern='*', debounce=WATCH_DEBOUNCE, jobs=1):
+    """
+    Keep the reports up to date with the result files in directory
+    matching pattern, until interrupted.
+
+    The directory is polled every WATCH_INTERVAL seconds. Once a batch
+    of new, changed or removed files has been quiet for debounce
+    seconds, only those files are (incrementally) parsed, and the
+    reports are regenerated from the parsed state of every file, which
+    is kept in memory between batches. The lookup tables are reloaded,
+    and every file reparsed (by fresh worker processes, with jobs other
+    than 1), only when their modification times change. A malformed
+    fail code table is reported and the previous tables kept until the
+    tables change again.
+    """
+    print("Watching %s for result files. Press Ctrl-C to stop.\n" % directory)
+    results = {}
+    seen = {}
+    dirty = set()
+    settled = 0
+    stamp = table_stamp()
+    rejected = None
+    pool = None
+    try:
+        while True:
+            files = list_result_files(directory, pattern)
+            current = table_stamp()
+            if current != stamp and current != rejected:
+                try:
+                    reload_tables()
+                except ValueError as exc:
+                    print(
+                        "%s: %s; keeping the previous tables."
+                        % (FAILCODE_FILENAME, exc), file=sys.stderr)
+                    rejected = current
+                else:
+                    stamp = current
+                    results.clear()
+                    seen = {}
+                    if pool is not None:
+                        # Workers keep their own table caches: start afresh.
+                        pool.shutdown()
+                        pool = None
+            changed = {
+                path for path, signature in files.items()
+                if seen.get(path) != signature
+            }
+            changed.update(seen.keys() - files.keys())
+            if changed:
+                dirty |= changed
+                settled = time.monotonic() + debounce
+                seen = files
+            if dirty and time.monotonic() >= settled:
+                if jobs != 1 and pool is None:
+                    pool = concurrent.futures.ProcessPoolExecutor(jobs or None)
+                refresh(sorted(dirty), results, pool.map if pool else map)
+                dirty.clear()
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def list_result_files(directory, pattern='*'):
+    """
+    Return {path: (mtime, size)} for the files in directory matching
+    pattern, other than this program's own inputs and outputs.
+    """
+    files = {}
+    for entry in os.scandir(directory):
+        if (
+            entry.name in OWN_FILENAMES
+            or not fnmatch.fnmatch(entry.name, pattern)
+            or not entry.is_file()
+        ):
+            continue
+        stat = entry.stat()
+        files[entry.path] = stat.st_mtime_ns, stat.st_size
+    return files
+
+
+def refresh(paths, results, mapper=map):
+    """
+    Bring results, {path: FileResult}, up to date for paths, then
+    regenerate the reports and status file from all of results.
+    """
+    states = [
+        results[path].state if path in results else FileState()
+        for path in paths
+    ]
+    for path, result in zip(paths, mapper(_parse_file, paths, states)):
+        if isinstance(result, OSError):
+            if not isinstance(result, FileNotFoundError):
+                print("Can't open %s: %s" % (path, result), file=sys.stderr)
+            results.pop(path, None)
+            continue
+        print("Processing file %s\n" % path)
+        sys.stdout.write(result.messages)
+        results[path] = result
+
+    part = PartTable()
+    part_count = 0
+    summary = Summary()
+    with open(OUTPUT_FILENAME, "w") as statfile:
+        for path in sorted(results):
+            result = results[path]
+            statfile.write(result.status)
+            part.extend(result.part, result.part_count, part_count)
+            part_count += result.part_count
+            summary.update(result.summary)
+    print("Total parts: %d" % part_count)
+    make_result_files(part, part_count, summary)
+    print("Reports updated at %s\n" % time.strftime("%H:%M:%S"))
+
+
+class Report:
+    """
+    A paginated fixed-width report, buffered a page at a time.
+
+    Rows are added whole, each counting for the given number of lines.
+    Every page starts with a form feed and the header of its section,
+    and ends with the footer; a page is written with a single write
+    when the next one starts, and the last by flush. A row starts a
+    new page at the beginning of a section, or once the page has run
+    past PAGE_LENGTH lines.
+
+    >>> out = io.StringIO()
+    >>> report = Report(out, page_length=2, header_lines=1)
+    >>> report.section("H1\\n")
+    >>> for row in "abc":
+    ...     report.row(row + "\\n")
+    >>> report.section("H2\\n")
+    >>> report.row("d\\n")
+    >>> report.flush()
+    >>> out.getvalue().split(chr(FF))
+    ['', '\\nH1\\na\\nb\\n', '\\nH1\\nc\\n', '\\nH2\\nd\\n']
+    >>> report.pages
+    3
+    """
+
+    def __init__(
+            self, resultfile, footer='', page_length=PAGE_LENGTH,
+            header_lines=HEADER_LINES):
+        self.resultfile = resultfile
+        self.header = ''
+        self.footer = footer
+        self.page_length = page_length
+        self.header_lines = header_lines
+        self.buffer = []
+        self.paglen = 0
+        self.pages = 0
+
+    def section(self, header):
+        """
+        Start a section; its first row begins a page headed by header.
+        """
+        self.header = header
+        self.paglen = 0
+
+    def row(self, text, lines=1):
+        if self.paglen == 0 or self.paglen > self.page_length:
+            self.flush()
+            self.buffer.append("%c\n%s" % (FF, self.header))
+            self.paglen = self.header_lines
+            self.pages += 1
+        self.buffer.append(text)
+        self.paglen += lines
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append(self.footer)
+            self.resultfile.write(''.join(self.buffer))
+            self.buffer.clear()
+
+
+def write_fails(part, part_count, resultfile):
+    """
+    Write one line per part, grouped by voltage (in the order first
+    seen), process, design and serial number. Each voltage and process
+    starts a new page.
+    """
+    voltages = Dimension()
+    order = sorted(
+        (
+            voltages.intern(part.voltage[i]),
+            part.process[i], part.design[i], part.sn[i], i,
+        )
+        for i in range(1, part_count + 1)
+        if part.design[i]
+    )
+
+    report = Report(resultfile)
+    group = design = None
+    for key in order:
+        i = key[-1]
+        if key[:2] != group:
+            group = key[:2]
+            design = None
+            report.section("%dV\n%s\n%s\n%s\n" % (
+                part.voltage[i], FAILS_HEADER, '=' * WIDTH,
+                part.get_processname(i),
+            ))
+        row = format_fails_row(
+            part.design[i], part.sn[i], part.pass_[i], part.sr[i],
+            part.fails(i),
+        )
+        if part.design[i] != design:
+            design = part.design[i]
+            report.row('\n' + row, 2)
         else:
-            print("Processing file %s\n" % argv)
+            report.row(row)
+    report.flush()
+
+
+def format_fails_row(design, sn, pass_, sr, failtype):
+    """
+    Return the results.fails line for one part.
+
+    >>> counts = [0] * len(FAILTYPES)
+    >>> counts[IPD] = counts[CONT] = 1
+    >>> format_fails_row(ord('B'), 12, ord('N'), ord('Y'), counts)
+    'B   12 N  Y        1                                                    1\\n'
+    """
+    fields = ["%c %4d %c  %c" % (design, sn, pass_, sr)]
+    for count, (filled, blank) in zip(failtype, FAILS_COLUMNS):
+        fields.append(filled % count if count > 0 else blank)
+    fields.append('\n')
+    return ''.join(fields)
+
+
+def format_matrix_row(summary, lines, width):
+    """
+    Return a results.proc or results.volt row: for each (prefix, keys)
+    in lines, the prefix and the cell of each key in width columns,
+    then the rule under the row.
+    """
+    fields = []
+    for prefix, keys in lines:
+        fields.append(prefix)
+        fields.extend(summary.format_cell(key, width) for key in keys)
+    fields.append("\n%s\n\n" % ('_' * WIDTH))
+    return ''.join(fields)
+
+
+def write_proc(summary, resultfile):
+    """
+    Write the fail/total matrix of design by voltage for each process.
+    """
+    processes, designs = summary.processes, summary.designs
+    voltages = [
+        voltage for voltage in range(len(summary.voltages))
+        if summary.voltages.values[voltage]
+    ]
+    pairs = sorted(
+        {(process, design) for process, design, voltage in summary.cells},
+        key=lambda pair: (processes.values[pair[0]], designs.values[pair[1]]),
+    )
+    columns = ''.join(
+        "%3.1fKV  " % (summary.voltages.values[voltage]/1000)
+        for voltage in voltages
+    )
+    report = Report(resultfile)
+    for process, rows in itertools.groupby(pairs, key=operator.itemgetter(0)):
+        report.section("PROCESS %s\n           DESIGN    %s\n%s\n\n" % (
+            processes.names[process], columns, '=' * WIDTH))
+        for process, design in rows:
+            report.row(format_matrix_row(summary, [(
+                "%17s    " % designs.names[design],
+                [(process, design, voltage) for voltage in voltages],
+            )], 7), 3)
+    report.flush()
+
+
+def write_volt(summary, resultfile):
+    """
+    Write the fail/total matrix of design by process for each voltage.
+    Processes alternate between two lines per design, the first,
+    third, fifth... on the first line and the rest on the second.
+    """
+    processes, designs = summary.processes, summary.designs
+    columns = processes.sorted()
+    pairs = sorted(
+        {
+            (voltage, design)
+            for process, design, voltage in summary.cells
+            if summary.voltages.values[voltage]
+        },
+        key=lambda pair: (pair[0], designs.values[pair[1]]),
+    )
+    letters = "%s\n                 %s" % (
+        ''.join("%c       " % processes.values[p] for p in columns[0::2]),
+        ''.join("       %c" % processes.values[p] for p in columns[1::2]),
+    )
+    report = Report(resultfile)
+    for voltage, rows in itertools.groupby(pairs, key=operator.itemgetter(0)):
+        report.section(
+            "VOLTAGE %4d\t\t\tPROCESS\n           DESIGN   %s\n%s\n\n" % (
+                summary.voltages.values[voltage], letters, '=' * WIDTH))
+        for voltage, design in rows:
+            report.row(format_matrix_row(summary, [
+                (
+                    "%17s   " % designs.names[design],
+                    [(process, design, voltage) for process in columns[0::2]],
+                ),
+                (
+                    "\n                        ",
+                    [(process, design, voltage) for process in columns[1::2]],
+                ),
+            ], 8), 3)
+    report.flush()
+
+
+def part_columns(part, part_count):
+    """
+    Return parts 1 through part_count as {column: array}, with the
+    columns of EXPORT_COLUMNS.
+
+    >>> part = PartTable()
+    >>> part.reserve(2)
+    >>> part.sn[1], part.sn[2] = 12, 34
+    >>> part.count_fail(2, CONT)
+    >>> columns = part_columns(part, 2)
+    >>> list(columns['sn']), list(columns['cont'])
+    ([12, 34], [0, 1])
+    """
+    width = len(FAILTYPES)
+    stop = part_count + 1
+    columns = dict(
+        sn=array.array('i', part.sn[1:stop]),
+        voltage=array.array('i', part.voltage[1:stop]),
+        process=part.process[1:stop],
+        design=part.design[1:stop],
+        resval=array.array('i', part.resval[1:stop]),
+        sr=part.sr[1:stop],
+    )
+    columns['pass'] = part.pass_[1:stop]
+    for column, name in enumerate(FAILTYPES):
+        columns[name] = part.failtype[width + column:stop * width:width]
+    return {name: columns[name] for name in EXPORT_COLUMNS}
+
+
+def summary_columns(summary):
+    """
+    Return the cells of summary as {column: array}, with the columns
+    of SUMMARY_COLUMNS, ordered by process, design and voltage.
+
+    >>> summary = Summary()
+    >>> summary.add('A', 'B', 2000, True, 'A Process', 'B Design')
+    >>> summary.add('A', 'B', 2000, False, 'A Process', 'B Design')
+    >>> columns = summary_columns(summary)
+    >>> [columns[name][0] for name in SUMMARY_COLUMNS]
+    [65, 66, 2000, 1, 2]
+    """
+    processes, designs, voltages = (
+        summary.processes, summary.designs, summary.voltages)
+    keys = sorted(summary.cells, key=lambda key: (
+        processes.values[key[0]], designs.values[key[1]],
+        voltages.values[key[2]],
+    ))
+    return dict(
+        process=array.array('B', (ord(processes.values[k[0]]) for k in keys)),
+        design=array.array('B', (ord(designs.values[k[1]]) for k in keys)),
+        voltage=array.array('i', (voltages.values[k[2]] for k in keys)),
+        fails=array.array('I', (summary.cells[k][0] for k in keys)),
+        total=array.array('I', (summary.cells[k][1] for k in keys)),
+    )
+
+
+def export_rows(columns):
+    """
+    Yield the rows of columns, with character codes as letters.
+    """
+    letters = [name in LETTER_COLUMNS for name in columns]
+    for row in zip(*columns.values()):
+        yield [
+            (chr(value) if value else '') if letter else value
+            for letter, value in zip(letters, row)
+        ]
+
+
+def write_csv(columns, stream):
+    writer = csv.writer(stream)
+    writer.writerow(columns)
+    writer.writerows(export_rows(columns))
+
+
+def write_jsonl(columns, stream):
+    for row in export_rows(columns):
+        stream.write(json.dumps(dict(zip(columns, row))) + '\n')
+
+
+def write_columns(columns, stream):
+    """
+    Write columns to a binary stream: a header of EXPORT_MAGIC, the
+    format version, the column and row counts, then each column's
+    name and typecode, followed by each column's values, packed
+    little-endian one column after another.
+    """
+    rows = len(next(iter(columns.values()), ()))
+    stream.write(struct.pack(
+        '<4sHHQ', EXPORT_MAGIC, EXPORT_VERSION, len(columns), rows))
+    for name, column in columns.items():
+        stream.write(struct.pack(
+            '<B%dsc' % len(name), len(name), name.encode(),
+            column.typecode.encode()))
+    for column in columns.values():
+        if sys.byteorder == 'big':
+            column = array.array(column.typecode, column)
+            column.byteswap()
+        stream.write(column.tobytes())
+
+
+def read_columns(stream):
+    """
+    Read columns written by write_columns.
+
+    >>> stream = io.BytesIO()
+    >>> write_columns(dict(sn=array.array('i', [12, 34])), stream)
+    >>> _ = stream.seek(0)
+    >>> read_columns(stream)
+    {'sn': array('i', [12, 34])}
+    """
+    magic, version, count, rows = struct.unpack('<4sHHQ', stream.read(16))
+    if magic != EXPORT_MAGIC or version != EXPORT_VERSION:
+        raise ValueError("not an esdsort column export")
+    names = []
+    for _ in range(count):
+        length, = stream.read(1)
+        name, typecode = struct.unpack('<%dsc' % length, stream.read(length + 1))
+        names.append((name.decode(), typecode.decode()))
+    columns = {}
+    for name, typecode in names:
+        column = columns[name] = array.array(typecode)
+        column.frombytes(stream.read(rows * column.itemsize))
+        if sys.byteorder == 'big':
+            column.byteswap()
+    return columns
+
+
+def write_npz(columns, stream):
+    numpy.savez(stream, **{
+        name: numpy.array(column, dtype=column.typecode)
+        for name, column in columns.items()
+    })
+
+
+EXPORT_FORMATS = {
+    '.csv': (write_csv, "w"),
+    '.jsonl': (write_jsonl, "w"),
+    '.bin': (write_columns, "wb"),
+    '.npz': (write_npz, "wb"),
+}
+"""Export writer and file mode for each export file extension"""
+
+
+def export(filename, columns):
+    """
+    Write columns to filename in the format named by its extension.
+    """
+    writer, mode = EXPORT_FORMATS[os.path.splitext(filename)[1].lower()]
+    with open(filename, mode, **({'newline': ''} if mode == "w" else {})) \
+            as stream:
+        writer(columns, stream)
+
+
+def write_types(part, part_count, resultfile):
+    """
+    Write the fail type counts of all parts summed by voltage, by
+    process and by design (see PartTable.breakdown), one page each.
+
+    >>> part = PartTable()
+    >>> part.reserve(2)
+    >>> part.voltage[1] = part.voltage[2] = 2000
+    >>> part.set_processname(1, 'A Process')
+    >>> part.set_processname(2, 'A Process')
+    >>> part.count_fail(1, ICC)
+    >>> part.count_fail(2, ICC)
+    >>> out = io.StringIO()
+    >>> write_types(part, 2, out)
+    >>> print(out.getvalue().split(chr(FF))[2].splitlines()[5])
+    A           2    0    0    0    0    0    0    0    0    0    0    0    0
+    """
+    report = Report(resultfile)
+    columns = ''.join("%5s" % name.upper() for name in FAILTYPES)
+    for name, label in (
+            ('voltage', "%dV"), ('process', "%s"), ('design', "%s")):
+        report.section("FAIL TYPES BY %s\n%-8s%s\n%s\n\n" % (
+            name.upper(), name.upper(), columns, '=' * WIDTH))
+        for value, counts in sorted(part.breakdown(name, part_count).items()):
+            key = label % value if value not in ('\0', 0) else "none"
+            report.row("%-8s%s\n" % (
+                key, ''.join("%5d" % count for count in counts)))
+    report.flush()
+
+
+def count_parts(
+        filenames, part, part_count, summary, jobs=1, incremental=False,
+        stats=None, store=None, readers=None, failed=None,
+        summary_only=False, retests=None):
+    """
+    Parse each file into part after the first part_count parts and
+    fold its counts into summary, returning the new part count. With
+    jobs other than 1, files are parsed in a pool of worker processes
+    (jobs=0 for one per CPU); results are still merged in file order.
+    When incremental, parsing resumes from the CHECKPOINT_FILENAME
+    state saved by the previous incremental run, so only lines added
+    since are read. Each file's counters are added to stats, if given.
+    Given a PartStore, files it already holds unchanged are skipped,
+    and the parts of the others are saved to it.
+
+    Given readers, files are read that many at a time by ingest
+    instead, and a file that can't be read is reported and left out
+    (its name added to failed) rather than ending the run.
+
+    When summary_only, each part is only folded into summary, as it is
+    parsed, and never stored in part; only the count is returned.
+
+    Given Retests, a part tested again at the same voltage is resolved
+    by its policy as it is added, summary is folded from the parts
+    kept, and the retest counts are written to the status file.
+    """
+    start = part_count
+    try:
+        statfile = open(OUTPUT_FILENAME, "a")
+    except Exception:
+        print(
+            "Cannot open output file %s." % OUTPUT_FILENAME,
+            file=sys.stderr)
+        sys.exit(1)
+
+    paths = list(map(os.path.abspath, filenames))
+    signatures = {}
+    if store is not None:
+        unstored = []
+        for filename, path in zip(filenames, paths):
             try:
-                statfile = open(OUTPUT_FILENAME, "a")
-            except Exception:
+                signatures[path] = file_signature(path)
+            except OSError:
+                pass
+            else:
+                if store.ingested(path, signatures[path]):
+                    print("Skipping file %s, already stored\n" % filename)
+                    continue
+            unstored.append((filename, path))
+        filenames = [filename for filename, path in unstored]
+        paths = [path for filename, path in unstored]
+
+    if incremental:
+        checkpoint = load_checkpoint(CHECKPOINT_FILENAME)
+        states = [checkpoint.get(path) or FileState() for path in paths]
+    else:
+        states = [None] * len(filenames)
+
+    parse = _summarize_file if summary_only else _parse_file
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(statfile)
+        if readers:
+            results = ingest(filenames, readers)
+        elif jobs == 1 or len(filenames) <= 1:
+            results = map(parse, filenames, states)
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(jobs or None)
+            stack.enter_context(pool)
+            results = pool.map(parse, filenames, states)
+
+        checkpoint = {}
+        for filename, path, result in zip(filenames, paths, results):
+            if isinstance(result, OSError):
                 print(
-                    "Cannot open output file %s." % OUTPUT_FILENAME,
+                    "Can't open %s.\nPlease check path and filename."
+                    % filename,
                     file=sys.stderr)
-                sys.exit(1)
+                if not readers:
+                    sys.exit(1)
+                if failed is not None:
+                    failed.append(filename)
+                continue
+            print("Processing file %s\n" % filename)
+            sys.stdout.write(result.messages)
+            statfile.write(result.status)
+            if retests is not None:
+                part_count = retests.add(
+                    part, part_count, result.part, result.part_count)
             else:
-                while True:
-                    inline = infile.read(MAXLINE)
-                    if not inline:
-                        break
-                    position = textfind(inline, "@")
-                    if position != EOF:
-                        position += 1
-                        count = 0
-                        while inline[position + count] != ' ':
-                            tempstring[count:count + 1] = inline[position + count]
-                            count += 1
-                        tempstring[count:count + 1] = '\x00'
-                        part[part_count].voltage = atoi(tempstring)
-                        if tempstring[1].upper() == 'K':
-                            part[part_count].voltage = part[part_count].voltage * 1000
-
-                    position = textfind(inline, "S/N")
-                    if position != EOF:
-                        position = position + 6
-                        part_count += 1
-                        part[part_count].sr = 'N'
-                        part[part_count].failtype.icc = \
-                            part[part_count].failtype.ipd = \
-                            part[part_count].failtype.inph = \
-                            part[part_count].failtype.inpl = \
-                            part[part_count].failtype.iodh = \
-                            part[part_count].failtype.iodl = \
-                            part[part_count].failtype.iozh = \
-                            part[part_count].failtype.iozl = \
-                            part[part_count].failtype.odh = \
-                            part[part_count].failtype.odl = \
-                            part[part_count].failtype.ozh = \
-                            part[part_count].failtype.ozl = \
-                            part[part_count].failtype.cont = 0
-                        part[part_count].pass_ = 'Y'
-
-                        if inline[position] == ' ':
-                            if inline[position + 1] == ' ':
-                                position = position + 2
-                            else:
-                                position = position + 1
-
-                        count = 0
-                        while count < 4:
-                            tempstring[count:count + 1] = inline[position + count]
-                            count += 1
-
-                        tempstring[count:count + 1] = '\x00'
-                        part[part_count].sn = atoi(tempstring)
-                        if ser2pro(part[part_count].sn) is not None:
-                            part[part_count].processname = \
-                                ser2pro(part[part_count].sn)
-                            part[part_count].process = part[part_count].processname[0]
-                        else:
-                            part[part_count].processname = "P Process"
-                            part[part_count].process = 'P'
-
-                    if textfind(inline, "   ****") != EOF:
-                        part[part_count].pass_ = 'N'
-                        count = 0
-                        while count < 3:
-                            tempstring[count:count + 1] = inline[count + 3]
-                            count += 1
-                        tempstring[count:count + 1] = '\x00'
-                        failcode = atoi(tempstring)
-                        if failcode == 860 or failcode == 881:
-                            part[part_count].failtype.icc += 1
-                        elif failcode == 790 or failcode == 813:
-                            part[part_count].failtype.ipd += 1
-                        elif failcode == 524:
-                            part[part_count].failtype.inph += 1
-                        elif failcode == 544:
-                            part[part_count].failtype.inpl += 1
-                        elif failcode == 615:
-                            part[part_count].failtype.iodh += 1
-                        elif failcode == 634:
-                            part[part_count].failtype.iodl += 1
-                        elif failcode == 574:
-                            part[part_count].failtype.iozh += 1
-                        elif failcode == 593:
-                            part[part_count].failtype.iozl += 1
-                        elif failcode == 697:
-                            part[part_count].failtype.odh += 1
-                        elif failcode == 716:
-                            part[part_count].failtype.odl += 1
-                        elif failcode == 656:
-                            part[part_count].failtype.ozh += 1
-                        elif failcode == 675:
-                            part[part_count].failtype.ozl += 1
-                        elif failcode == 315:
-                            part[part_count].failtype.cont += 1
-                        elif failcode == 938:
-                            print("Identity fail.  Check status file", OUTPUT_FILENAME)
-                            print(
-                                "Identity fail on sn%d" % part[part_count].sn,
-                                file=statfile)
-                            print(
-                                "Zapped at %d volts\n" % part[part_count].voltage,
-                                file=statfile)
-                        else:
-                            print("Error!!!  Undefined fail code %d." % failcode)
-
-                    if textfind(inline, "938") == 4:
-                        count = 0
-                        while count < 3:
-                            tempstring[count:count + 1] = inline[14 + count]
-                            count += 1
-                        tempstring[count:count + 1] = '\x00'
-                        part[part_count].resval = atoi(tempstring)
-                        if res2des(part[part_count].resval) is not None:
-                            part[part_count].designname = \
-                                res2des(part[part_count].resval)
-                            part[part_count].design = part[part_count].designname[0]
-                        else:
-                            part[part_count].designname = "D Design"
-                            part[part_count].design = 'D'
-
-                    if textfind(inline, "FAIL") == 20:
-                        part[part_count].pass_ = 'N'
-                        part[part_count].sr = 'Y'
-                    else:
-                        part[part_count].sr = 'N'
-
-        print("Sorting successful!\n")
-        infile.close()
-        statfile.close()
+                if not summary_only:
+                    part.extend(result.part, result.part_count, part_count)
+                part_count += result.part_count
+                summary.update(result.summary)
+            checkpoint[path] = result.state
+            if stats is not None:
+                stats.counters.update(result.counters)
+            if store is not None:
+                store.add(
+                    path, signatures.get(path, (None, None)),
+                    result.part, result.part_count, result.status)
+
+        if retests is not None:
+            for i in range(start + 1, part_count + 1):
+                summary.add_part(part, i)
+            retests.report(statfile)
+
+    if incremental:
+        save_checkpoint(CHECKPOINT_FILENAME, checkpoint)
+    print("Sorting successful!\n")
     return part_count
 
 
-def filecopy(infile):
-    while True:
-        c = infile.read(1)
-        if not c:
-            break
-        sys.stdout.write(c, flush=True)
+FileResult = collections.namedtuple(
+    'FileResult', 'part part_count summary status messages state counters')
+
+
+class FileState:
+    """
+    Where parsing of one result file left off: the byte offset just
+    past the last complete line read, the scanner, the parts so far
+    (the last of which may still gain fail lines), the Summary of all
+    but the last part, and the status file text.
+    """
+
+    def __init__(self, ident=None):
+        self.ident = ident
+        self.offset = 0
+        self.scanner = Scanner()
+        self.part = PartTable()
+        self.part_count = 0
+        self.folded = 0
+        self.summary = Summary()
+        self.status = ''
+
+
+def parse_file(filename, state=None, stream=None):
+    """
+    Parse one result file on its own, returning a picklable FileResult
+    with its parts, their Summary, the text destined for the status
+    file and the console, and the FileState reached.
+
+    Given a FileState (empty, or from an earlier parse of the same
+    file), parsing picks up where it left off and stops after the last
+    complete line, so the file can keep growing between calls. The
+    state starts over if the file was replaced or truncated, and
+    compressed files are always read from the start.
+
+    Given an open binary stream, that is parsed from start to end in
+    place of the named file, and state is ignored.
+
+    The counters count the lines, parts and bytes read by this call,
+    and the table lookups it made.
+
+    Resuming a file that was cut mid-line gives the same parts and
+    Summary as parsing it whole, and so do summarize_file and ingest:
+
+    >>> import tempfile
+    >>> data = b"".join(
+    ...     b"S/N:   %04d\\n@ %dKV\\n   656   ****\\n   938        %d  %s\\n"
+    ...     % (sn, sn % 3 + 1, 100 + sn * 37 % 900, b"FAIL" if sn % 4 else b"PASS")
+    ...     for sn in range(1, 13))
+    >>> cut = len(data) // 2 + 5
+    >>> data[cut - 1:cut + 1]
+    b'  '
+    >>> def parts(result):
+    ...     return [result.part.record(i) for i in range(1, result.part_count + 1)]
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, 'results.txt')
+    ...     with open(filename, 'wb') as resultfile:
+    ...         _ = resultfile.write(data[:cut])
+    ...     first = parse_file(filename, FileState())
+    ...     held_back = first.state.offset < cut
+    ...     partial = first.part_count
+    ...     with open(filename, 'ab') as resultfile:
+    ...         _ = resultfile.write(data[cut:])
+    ...     resumed = parse_file(filename, first.state)
+    ...     full = parse_file(filename)
+    ...     summarized = summarize_file(filename)
+    ...     read, = ingest([filename], 2)
+    >>> held_back, 0 < partial < full.part_count
+    (True, True)
+    >>> parts(resumed) == parts(full), resumed.summary.cells == full.summary.cells
+    (True, True)
+    >>> summarized.part_count == full.part_count
+    True
+    >>> summarized.summary.cells == full.summary.cells
+    True
+    >>> parts(read) == parts(full), read.summary.cells == full.summary.cells
+    (True, True)
+    """
+    lookups = lookup_counts()
+    status = io.StringIO()
+    messages = io.StringIO()
+    if stream is not None:
+        state = FileState()
+        state.part_count = load_parts(
+            scan_file(stream, state.scanner), state.part, 0, status, messages)
+        return _file_result(
+            state, 0, stream.tell(), 0, 0, lookups, status, messages)
+
+    with open(filename, "rb") as infile, contextlib.ExitStack() as stack:
+        stat = os.fstat(infile.fileno())
+        ident = stat.st_dev, stat.st_ino
+        resume = state is not None and compression(infile) is None
+        if not resume or state.ident != ident or stat.st_size < state.offset:
+            state = FileState(ident)
+        start, lines, part_count = (
+            state.offset, state.scanner.lines, state.part_count)
+        if not resume:
+            records = scan_file(infile, state.scanner)
+            end = stat.st_size
+        else:
+            buffer = b''
+            if stat.st_size:
+                buffer = stack.enter_context(
+                    mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+            end = buffer.rfind(b'\n', state.offset) + 1 or state.offset
+            records = state.scanner.scan(buffer, state.offset, end)
+        state.part_count = load_parts(
+            records, state.part, state.part_count, status, messages)
+    return _file_result(
+        state, start, end, lines, part_count, lookups, status, messages)
+
+
+def _file_result(state, start, end, lines, part_count, lookups, status,
+                 messages):
+    """
+    Finish a parse_file call that read bytes start to end, returning
+    its FileResult. lines, part_count and lookups are what the scanner
+    line count, part count and lookup_counts were at the start.
+    """
+    counters = lookup_counts()
+    counters.subtract(lookups)
+    counters.update(
+        lines=state.scanner.lines - lines,
+        parts=state.part_count - part_count,
+        bytes_read=end - start,
+    )
+    state.offset = end
+    state.status += status.getvalue()
+
+    for i in range(state.folded + 1, state.part_count):
+        state.summary.add_part(state.part, i)
+    state.folded = max(state.folded, state.part_count - 1)
+    summary = Summary()
+    summary.update(state.summary)
+    if state.part_count:
+        summary.add_part(state.part, state.part_count)
+
+    state.part.trim(state.part_count)
+    return FileResult(
+        state.part, state.part_count, summary,
+        state.status, messages.getvalue(), state, dict(counters),
+    )
+
+
+def summarize_file(filename):
+    """
+    Parse one result file like parse_file, but fold each part into the
+    Summary as soon as it is complete and keep none of them, so memory
+    is bounded by the number of distinct processes, designs and
+    voltages rather than of parts. The Summary also sums fail types
+    (see Summary). The FileResult's part table is
+    empty (part_count still counts the parts) and it has no state.
+    """
+    lookups = lookup_counts()
+    status = io.StringIO()
+    messages = io.StringIO()
+    scanner = Scanner()
+    summary = Summary(failtypes=True)
+    part = PartTable(2)
+    part_count = 0
+    with open(filename, "rb") as infile:
+        size = os.fstat(infile.fileno()).st_size
+        for run in _split_parts(scan_file(infile, scanner)):
+            if load_parts(run, part, 0, status, messages):
+                part_count += 1
+                summary.add_part(part, 1)
+    counters = lookup_counts()
+    counters.subtract(lookups)
+    counters.update(lines=scanner.lines, parts=part_count, bytes_read=size)
+    return FileResult(
+        PartTable(), part_count, summary, status.getvalue(),
+        messages.getvalue(), None, dict(counters),
+    )
+
+
+Part = collections.namedtuple(
+    'Part',
+    'sn voltage pass_ sr resval process design processname designname failtype',
+)
+Part.__doc__ = """
+A parsed part. pass_ and sr are 'Y' or 'N', process and design are
+letters ('' for a part without an identity line), and failtype is a
+tuple of counters in FAILTYPES order.
+"""
+
+
+def iter_parts(sources):
+    """
+    Lazily parse result files, yielding each part as an immutable Part
+    as soon as it is complete.
+
+    sources may mix file names and open streams (binary preferred).
+    Only the part being parsed is held in memory, and nothing is
+    printed or written: identity fails and unknown fail codes are
+    silently left out. Each source is parsed on its own, as with
+    parse_file.
+
+    >>> result = io.BytesIO(
+    ...     b"S/N:   0012\\n@ 2KV\\n   524   ****\\n   938        470\\n"
+    ...     b"S/N:   0013\\n@ 4KV\\n")
+    >>> first, second = iter_parts([result])
+    >>> first.sn, first.voltage, first.pass_, first.resval, first.failtype[INPH]
+    (12, 2000, 'N', 470, 1)
+    >>> second.sn, second.voltage, second.pass_, second.design
+    (13, 4000, 'Y', '')
+    """
+    discard = _NullWriter()
+    for source in sources:
+        with contextlib.ExitStack() as stack:
+            if isinstance(source, (str, bytes, os.PathLike)):
+                source = stack.enter_context(open(source, "rb"))
+            if isinstance(source, io.TextIOBase):
+                records = scan_records(line.encode('latin-1') for line in source)
+            else:
+                records = scan_file(source)
+
+            part = PartTable(2)
+            part_count = 0
+            for run in _split_parts(records):
+                if part_count and run[0][0] == SERIAL:
+                    yield part.record(part_count)
+                part_count = load_parts(run, part, 0, discard, discard)
+            if part_count:
+                yield part.record(part_count)
+
+
+def _split_parts(records):
+    """
+    Group records into lists, starting a new list at each SERIAL.
+    """
+    run = []
+    for record in records:
+        if record[0] == SERIAL and run:
+            yield run
+            run = []
+        run.append(record)
+    if run:
+        yield run
+
+
+def _summarize_file(filename, state=None):
+    """
+    summarize_file, handing back an unreadable file's error like
+    _parse_file. state is ignored.
+    """
+    try:
+        return summarize_file(filename)
+    except OSError as exc:
+        return exc
+
+
+class _NullWriter:
+    def write(self, text):
+        return len(text)
+
+
+def _parse_file(filename, state=None, stream=None):
+    """
+    parse_file, handing back an unreadable file's error rather than
+    raising it, so it is reported in file order.
+    """
+    try:
+        return parse_file(filename, state, stream)
+    except OSError as exc:
+        return exc
+
+
+def ingest(filenames, limit, blocksize=BLOCKSIZE):
+    """
+    Parse the named files, reading up to limit of them at a time on an
+    asyncio event loop (each read of blocksize bytes offloaded to a
+    thread) while one parser thread takes the files in order. Return
+    each file's FileResult, or the OSError that stopped it, in order;
+    a file that fails doesn't stop the others.
+
+    Each file is read at most READAHEAD blocks ahead of the parser.
+    """
+    return asyncio.run(_ingest(filenames, limit, blocksize))
+
+
+async def _ingest(filenames, limit, blocksize):
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(limit)
+    queues = [asyncio.Queue(READAHEAD) for filename in filenames]
+    readers = [
+        asyncio.create_task(_read_blocks(filename, blocks, slots, blocksize))
+        for filename, blocks in zip(filenames, queues)
+    ]
+    results = []
+    try:
+        for filename, blocks, reader in zip(filenames, queues, readers):
+            results.append(await asyncio.to_thread(
+                _parse_file, filename, stream=_BlockStream(blocks, loop)))
+            reader.cancel()
+    finally:
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+    return results
+
+
+async def _read_blocks(filename, blocks, slots, blocksize):
+    """
+    Put the blocks of the named file on blocks, then b'', or put the
+    OSError that cut reading short.
+    """
+    async with slots:
+        try:
+            infile = await asyncio.to_thread(open, filename, "rb")
+        except OSError as exc:
+            await blocks.put(exc)
+            return
+        try:
+            while True:
+                try:
+                    block = await asyncio.to_thread(infile.read, blocksize)
+                except OSError as exc:
+                    await blocks.put(exc)
+                    return
+                await blocks.put(block)
+                if not block:
+                    return
+        finally:
+            infile.close()
+
+
+class _BlockStream:
+    """
+    A binary stream, read from a thread other than the event loop's,
+    over the blocks that _read_blocks puts on an asyncio queue.
+    """
+
+    def __init__(self, blocks, loop):
+        self.blocks = blocks
+        self.loop = loop
+        self.buffer = b''
+        self.finished = False
+        self.position = 0
+
+    def _fill(self):
+        while not self.buffer and not self.finished:
+            block = asyncio.run_coroutine_threadsafe(
+                self.blocks.get(), self.loop).result()
+            if isinstance(block, OSError):
+                self.finished = True
+                raise block
+            self.buffer = block
+            self.finished = not block
+
+    def peek(self, size=0):
+        self._fill()
+        return self.buffer
+
+    def read(self, size=-1):
+        self._fill()
+        if size is None or size < 0 or size >= len(self.buffer):
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+
+def table_stamp():
+    """
+    Return the modification times of the lookup tables, which parsed
+    parts depend on.
+    """
+    stamps = []
+    for filename in (PROCESS_FILENAME, DESIGN_FILENAME, FAILCODE_FILENAME):
+        try:
+            stamps.append(os.stat(filename).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
 
+def load_checkpoint(filename):
+    """
+    Return the {path: FileState} saved by save_checkpoint, or an empty
+    dict if there is none or the lookup tables have changed since.
+    """
+    try:
+        with open(filename, "rb") as checkpoint:
+            version, stamp, states = pickle.load(checkpoint)
+    except Exception:
+        return {}
+    if version != CHECKPOINT_VERSION or stamp != table_stamp():
+        return {}
+    return states
+
+
+def save_checkpoint(filename, states):
+    temp = filename + ".tmp"
+    with open(temp, "wb") as checkpoint:
+        pickle.dump(
+            (CHECKPOINT_VERSION, table_stamp(), states), checkpoint,
+            protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, filename)
 
-def textfind(line, text):
+
+class PartStore:
     """
-    Search for text in line
+    SQLite database of the parts parsed from each result file, so
+    reports can cover files parsed by earlier runs.
+
+    ``sources`` records each ingested file with the size and
+    modification time it had, and its status file text. ``parts``
+    holds one row per part, indexed by serial number, voltage, process
+    and design. A file ingested again replaces its earlier parts.
+    ``cells`` is the aggregate index: fail/total and fail type counts
+    for each file, process, design and voltage, of the parts with a
+    design, kept up to date as files are ingested so that query can
+    answer without touching ``parts``.
+
+    A store opened with readonly true never writes, so it can be read
+    while another process ingests; only a writable store can be set up
+    with create.
+
+    >>> store = PartStore(':memory:')
+    >>> store.create()
+    >>> part = PartTable()
+    >>> part.reserve(1)
+    >>> part.sn[1], part.voltage[1] = 12, 2000
+    >>> part.set_processname(1, 'A Process')
+    >>> store.add('a.txt', (10, 1), part, 1, '')
+    >>> store.ingested('a.txt', (10, 1)), store.ingested('a.txt', (11, 1))
+    (True, False)
+    >>> loaded = PartTable()
+    >>> store.load(loaded)
+    1
+    >>> loaded.record(1).processname, loaded.record(1).design
+    ('A Process', '')
     """
-    i = 0
-    n = 0
-    status = 0
 
-    while line[i] != '\n':
-        if line[i] == text[n]:
-            for n in range(len(text)):
-                if line[i+n] != text[n]:
-                    status = FAIL
+    schema = """
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            size INTEGER,
+            mtime_ns INTEGER,
+            status TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS parts (
+            source INTEGER NOT NULL REFERENCES sources(id),
+            seq INTEGER NOT NULL,
+            sn INTEGER,
+            voltage INTEGER,
+            pass TEXT,
+            sr TEXT,
+            resval INTEGER,
+            process TEXT,
+            design TEXT,
+            processname TEXT,
+            designname TEXT,
+            %s,
+            PRIMARY KEY (source, seq)
+        );
+        CREATE INDEX IF NOT EXISTS parts_sn ON parts (sn);
+        CREATE INDEX IF NOT EXISTS parts_voltage ON parts (voltage);
+        CREATE INDEX IF NOT EXISTS parts_process ON parts (process);
+        CREATE INDEX IF NOT EXISTS parts_design ON parts (design);
+        CREATE TABLE IF NOT EXISTS cells (
+            source INTEGER NOT NULL REFERENCES sources(id),
+            process TEXT,
+            design TEXT,
+            voltage INTEGER,
+            fails INTEGER,
+            total INTEGER,
+            %s,
+            PRIMARY KEY (source, process, design, voltage)
+        );
+    """ % ((',\n            '.join('%s INTEGER' % name for name in FAILTYPES),) * 2)
+
+    fold = """
+        INSERT INTO cells
+        SELECT source, process, design, voltage,
+            SUM(pass = 'N'), COUNT(*), %s
+        FROM parts WHERE source IN (%%s) AND design != ''
+        GROUP BY source, process, design, voltage
+    """ % ', '.join('SUM(%s)' % name for name in FAILTYPES)
+
+    fields = (
+        'sn', 'voltage', 'pass', 'sr', 'resval', 'process', 'design',
+        'processname', 'designname',
+    ) + FAILTYPES
+
+    def __init__(self, filename, readonly=False):
+        if readonly:
+            self.connection = sqlite3.connect(
+                'file:%s?mode=ro' % urllib.parse.quote(filename), uri=True)
+        else:
+            self.connection = sqlite3.connect(filename)
+
+    def create(self):
+        """
+        Create any missing tables and indexes, and fill ``cells`` for
+        sources ingested before it existed.
+        """
+        self.connection.executescript(self.schema)
+        with self.connection:
+            self.connection.execute(self.fold % (
+                "SELECT id FROM sources "
+                "WHERE id NOT IN (SELECT source FROM cells)"))
+
+    def close(self):
+        self.connection.close()
+
+    def ingested(self, path, signature):
+        """
+        Return whether path was ingested when its (size, mtime_ns)
+        was signature.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns FROM sources WHERE path = ?",
+            (path,)).fetchone()
+        return row == tuple(signature)
+
+    def add(self, path, signature, part, part_count, status):
+        """
+        Store parts 1 through part_count of part as the contents of
+        path, in one transaction.
+        """
+        width = len(FAILTYPES)
+        rows = (
+            (
+                i, part.sn[i], part.voltage[i],
+                _letter(part.pass_[i]), _letter(part.sr[i]), part.resval[i],
+                _letter(part.process[i]), _letter(part.design[i]),
+                part.get_processname(i), part.get_designname(i),
+            ) + tuple(part.failtype[i * width:(i + 1) * width])
+            for i in range(1, part_count + 1)
+        )
+        insert = "INSERT INTO parts (source, seq, %s) VALUES (?, ?%s)" % (
+            ', '.join(self.fields), ', ?' * len(self.fields))
+        with self.connection:
+            for table in ('parts', 'cells'):
+                self.connection.execute(
+                    "DELETE FROM %s WHERE source IN "
+                    "(SELECT id FROM sources WHERE path = ?)" % table, (path,))
+            self.connection.execute(
+                "DELETE FROM sources WHERE path = ?", (path,))
+            source = self.connection.execute(
+                "INSERT INTO sources (path, size, mtime_ns, status) "
+                "VALUES (?, ?, ?, ?)", (path,) + tuple(signature) + (status,)
+            ).lastrowid
+            while True:
+                batch = [
+                    (source,) + row
+                    for row in itertools.islice(rows, STORE_BATCH)
+                ]
+                if not batch:
                     break
-                else:
-                    status = PASS
-            if status == PASS:
-                return i + 1
+                self.connection.executemany(insert, batch)
+            self.connection.execute(self.fold % '?', (source,))
+
+    def load(self, part, part_count=0):
+        """
+        Load every stored part into part after the first part_count,
+        in ingest order, returning the new part count.
+        """
+        width = len(FAILTYPES)
+        cursor = self.connection.execute(
+            "SELECT %s FROM parts JOIN sources ON parts.source = sources.id "
+            "ORDER BY sources.id, seq" % ', '.join(self.fields))
+        for row in cursor:
+            part_count += 1
+            part.reserve(part_count)
+            part.sn[part_count], part.voltage[part_count] = row[0], row[1]
+            part.pass_[part_count], part.sr[part_count] = (
+                _code(row[2]), _code(row[3]))
+            part.resval[part_count] = row[4]
+            part.process[part_count] = _code(row[5])
+            part.design[part_count] = _code(row[6])
+            part.processname[part_count] = part.intern(row[7])
+            part.designname[part_count] = part.intern(row[8])
+            part.failtype[part_count * width:(part_count + 1) * width] = \
+                array.array('H', row[9:])
+        return part_count
+
+    def totals(self, by=(), **filters):
+        """
+        Return the fail, total and fail type counts of the cells
+        matching filters, summed for each combination of the columns
+        named in by, as rows of the by values, fails, total and the
+        FAILTYPES counts. filters may list values of process, design
+        and voltage, and bound the files' modification times in
+        nanoseconds with since and until.
+        """
+        where, values = [], []
+        for name in ('process', 'design', 'voltage'):
+            if filters.get(name):
+                where.append("cells.%s IN (%s)" % (
+                    name, ', '.join('?' * len(filters[name]))))
+                values.extend(filters[name])
+        if filters.get('since') is not None:
+            where.append("sources.mtime_ns >= ?")
+            values.append(filters['since'])
+        if filters.get('until') is not None:
+            where.append("sources.mtime_ns < ?")
+            values.append(filters['until'])
+        columns = ['cells.%s' % name for name in by]
+        sql = "SELECT %s FROM cells JOIN sources ON cells.source = sources.id" % (
+            ', '.join(columns + [
+                'SUM(%s)' % name for name in ('fails', 'total') + FAILTYPES]))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if columns:
+            sql += " GROUP BY %s ORDER BY %s" % ((', '.join(columns),) * 2)
+        return [
+            row for row in self.connection.execute(sql, values)
+            if row[len(by) + 1]
+        ]
+
+    def find(self, sn):
+        """
+        Return the stored parts with serial number sn, as (path, Part)
+        pairs in ingest order.
+        """
+        rows = self.connection.execute(
+            "SELECT path, %s FROM parts JOIN sources ON parts.source = sources.id "
+            "WHERE sn = ? ORDER BY sources.id, seq" % ', '.join(self.fields),
+            (sn,))
+        return [
+            (row[0], Part(*row[1:10], tuple(row[10:])))
+            for row in rows
+        ]
+
+    def status(self):
+        """
+        Return the status file text of every stored file.
+        """
+        return ''.join(
+            status for status, in self.connection.execute(
+                "SELECT status FROM sources ORDER BY id"))
+
+
+def _letter(code):
+    return chr(code) if code else ''
+
+
+def _code(letter):
+    return ord(letter) if letter else 0
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def save_shard(filename, summary, part_count):
+    """
+    Write summary (with failtypes) and the part count behind it to
+    filename as a shard: JSON holding the format and version, the
+    process, design and voltage dictionaries in id order, and one
+    [process, design, voltage, fails, total, fail types] row per cell.
+    """
+    blank = [0] * len(FAILTYPES)
+    failtypes = summary.failtypes or {}
+    shard = dict(
+        format=SHARD_FORMAT,
+        version=SHARD_VERSION,
+        parts=part_count,
+        processes=list(map(list, zip(
+            summary.processes.values, summary.processes.names))),
+        designs=list(map(list, zip(
+            summary.designs.values, summary.designs.names))),
+        voltages=summary.voltages.values,
+        cells=[
+            list(key) + cell + [failtypes.get(key, blank)]
+            for key, cell in summary.cells.items()
+        ],
+    )
+    temp = filename + ".tmp"
+    with open(temp, "w") as shardfile:
+        json.dump(shard, shardfile, separators=(',', ':'))
+        shardfile.write("\n")
+    os.replace(temp, filename)
+
+
+def load_shard(filename):
+    """
+    Return the Summary and part count saved by save_shard. Raises
+    ValueError for a file that isn't a shard of this version.
+
+    >>> import tempfile
+    >>> summary = Summary(failtypes=True)
+    >>> summary.add('A', 'B', 2000, True, 'A Process', 'B Design', [1] * 13)
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, 'shard.json')
+    ...     save_shard(filename, summary, 3)
+    ...     loaded, part_count = load_shard(filename)
+    >>> loaded.cells, loaded.failtypes[0, 0, 0][ICC], part_count
+    ({(0, 0, 0): [1, 1]}, 1, 3)
+
+    Cells naming a process, design or voltage the shard doesn't list,
+    or with the wrong number of fail type counters, are rejected:
+
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, 'shard.json')
+    ...     save_shard(filename, summary, 3)
+    ...     with open(filename) as shardfile:
+    ...         shard = json.load(shardfile)
+    ...     for cell in ([5, 0, 0, 1, 1, [0] * 13], [0, 0, 0, 1, 1, [0]]):
+    ...         shard['cells'] = [cell]
+    ...         with open(filename, 'w') as shardfile:
+    ...             json.dump(shard, shardfile)
+    ...         try:
+    ...             load_shard(filename)
+    ...         except ValueError as exc:
+    ...             print(exc)
+    cell id 5 out of range
+    cell has 1 fail type counters, expected 13
+    """
+    with open(filename) as shardfile:
+        shard = json.load(shardfile)
+    if not isinstance(shard, dict) or shard.get('format') != SHARD_FORMAT:
+        raise ValueError("not a shard summary")
+    if shard.get('version') != SHARD_VERSION:
+        raise ValueError("shard version %s, expected %d" % (
+            shard.get('version'), SHARD_VERSION))
+    summary = Summary(failtypes=True)
+    for value, name in shard['processes']:
+        summary.processes.intern(value, name)
+    for value, name in shard['designs']:
+        summary.designs.intern(value, name)
+    for value in shard['voltages']:
+        summary.voltages.intern(value)
+    dimensions = (summary.processes, summary.designs, summary.voltages)
+    for process, design, voltage, fails, total, counters in shard['cells']:
+        for index, dimension in zip((process, design, voltage), dimensions):
+            if not isinstance(index, int) or not 0 <= index < len(dimension):
+                raise ValueError("cell id %r out of range" % (index,))
+        if len(counters) != len(FAILTYPES):
+            raise ValueError("cell has %d fail type counters, expected %d" % (
+                len(counters), len(FAILTYPES)))
+        summary.cells[process, design, voltage] = [fails, total]
+        summary.failtypes[process, design, voltage] = counters
+    return summary, shard['parts']
+
+
+def load_parts(records, part, part_count, statfile, console=sys.stdout):
+    """
+    Store the parts described by records (as produced by
+    scan_records) in part, after the first part_count parts.
+    Records that come before the first serial number land in the
+    scratch entry at index part_count. Identity fails are logged to
+    statfile and warnings to console. Return the new part count.
+    """
+    failcodes = load_failcodes(FAILCODE_FILENAME)
+    for kind, value in records:
+        if kind == VOLTAGE:
+            part.voltage[part_count] = value
+
+        elif kind == SERIAL:
+            part_count += 1
+            part.reserve(part_count)
+            part.sr[part_count] = ord('N')
+            part.clear_fails(part_count)
+            part.pass_[part_count] = ord('Y')
+            part.sn[part_count] = value
+            part.voltage[part_count] = part.resval[part_count] = 0
+            part.design[part_count] = part.designname[part_count] = 0
+            processname = ser2pro(value)
+            if processname is None:
+                processname = "P Process"
+            part.set_processname(part_count, processname)
+
+        elif kind == FAILCODE:
+            part.pass_[part_count] = ord('N')
+            column = failcodes.get(value)
+            if column is not None:
+                part.count_fail(part_count, column)
+            elif value == IDENTITY_FAIL:
+                print(
+                    "Identity fail.  Check status file", OUTPUT_FILENAME,
+                    file=console)
+                print(
+                    "Identity fail on sn%d" % part.sn[part_count],
+                    file=statfile)
+                print(
+                    "Zapped at %d volts\n" % part.voltage[part_count],
+                    file=statfile)
             else:
-                i += 1
-                n = 0
+                print(
+                    "Error!!!  Undefined fail code %d." % value,
+                    file=console)
+
+        elif kind == IDENTITY:
+            part.resval[part_count] = value
+            designname = res2des(value)
+            if designname is None:
+                designname = "D Design"
+            part.set_designname(part_count, designname)
+
         else:
-            i += 1
-    return EOF
+            if value:
+                part.pass_[part_count] = ord('N')
+                part.sr[part_count] = ord('Y')
+            else:
+                part.sr[part_count] = ord('N')
+
+    return part_count
+
+
+def scan_records(lines):
+    """
+    Classify each line (bytes) of a result file in a single pass,
+    yielding (kind, value) records in line order:
+
+    - (VOLTAGE, volts) for a zap line; the value follows "@ ".
+    - (SERIAL, sn) for an "S/N" line, which starts a new part.
+    - (FAILCODE, code) for a "   ****" fail line, code in columns 3-5.
+    - (IDENTITY, resval) for a "938" line, resval in columns 14-16.
+    - (STATUS, failed) whether "FAIL" sits in column 19. The status
+      applies to the current part until the next STATUS, so it is
+      only reported when it changes, and after every SERIAL.
+
+    >>> lines = [
+    ...     b"S/N:   0012\\n",
+    ...     b"ZAP @ 2KV HBM\\n",
+    ...     b"   524   ****\\n",
+    ...     b"   938        470  FAIL\\n",
+    ... ]
+    >>> list(scan_records(lines))
+    [(1, 12), (4, False), (0, 2000), (2, 524), (3, 470), (4, True)]
+    """
+    scanner = Scanner()
+    for line in lines:
+        yield from scanner.scan(line)
+
+
+def scan_file(infile, scanner=None):
+    """
+    Yield the records of an open binary result file. Regular files are
+    memory-mapped and scanned in place, so only the numeric fields are
+    ever copied out; anything that can't be mapped is read in blocks.
+    Gzip, bzip2 and xz files are decompressed on a BackgroundReader
+    thread while the blocks already read are scanned.
+    """
+    scanner = scanner or Scanner()
+    opener = compression(infile)
+    if opener is not None:
+        return _scan_background(BackgroundReader(opener(infile)), scanner)
+    try:
+        buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return scan_blocks(infile, scanner=scanner)
+    return _scan_mapped(buffer, scanner)
+
+
+def _scan_mapped(buffer, scanner):
+    with buffer:
+        yield from scanner.scan(buffer)
+
+
+def _scan_background(reader, scanner):
+    with contextlib.closing(reader):
+        yield from scan_blocks(reader, scanner=scanner)
+
+
+def compression(infile):
+    """
+    Return the function opening the compressed binary stream infile,
+    judged by its leading bytes, or None if it isn't compressed. The
+    stream is left where it was.
+
+    >>> compression(io.BytesIO(gzip.compress(b"S/N:   0012\\n"))) is gzip.open
+    True
+    >>> compression(io.BytesIO(b"S/N:   0012\\n")) is None
+    True
+    """
+    size = max(len(magic) for magic, opener in COMPRESSION)
+    try:
+        head = infile.peek(size)[:size]
+    except AttributeError:
+        try:
+            if not infile.seekable():
+                return None
+            head = infile.read(size)
+            infile.seek(-len(head), io.SEEK_CUR)
+        except (AttributeError, OSError, ValueError):
+            return None
+    for magic, opener in COMPRESSION:
+        if head.startswith(magic):
+            return opener
+    return None
+
+
+class BackgroundReader:
+    """
+    Read a stream (a decompressor, say) ahead on a background thread,
+    blocksize bytes at a time, into a queue of at most depth blocks, so
+    that producing the data overlaps with consuming it.
+
+    read returns the next block whatever size is asked for. Any error
+    met by the thread ends the stream and is raised by read, as OSError
+    (corrupt archives raise zlib.error, EOFError or LZMAError, say).
+
+    >>> reader = BackgroundReader(io.BytesIO(b"abcde"), blocksize=2)
+    >>> reader.read(2), reader.read(2), reader.read(2), reader.read(2)
+    (b'ab', b'cd', b'e', b'')
+    >>> reader.close()
+
+    Corrupt archives of each format raise OSError instead of hanging:
+
+    >>> data = b"".join(b"S/N:   %04d\\n@ 2KV\\n" % sn for sn in range(2000))
+    >>> for compress in (gzip.compress, bz2.compress, lzma.compress):
+    ...     archive = bytearray(compress(data))
+    ...     archive[len(archive) // 2:len(archive) // 2 + 50] = bytes(50)
+    ...     try:
+    ...         records = list(scan_file(io.BytesIO(archive)))
+    ...     except OSError:
+    ...         print(compress.__module__, "OSError")
+    gzip OSError
+    bz2 OSError
+    lzma OSError
+    """
+
+    def __init__(self, source, blocksize=BLOCKSIZE, depth=READAHEAD):
+        self.queue = queue.Queue(depth)
+        self.stopping = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(
+            target=self._fill, args=(source, blocksize), daemon=True)
+        self.thread.start()
+
+    def _fill(self, source, blocksize):
+        end = b''
+        try:
+            with source:
+                while not self.stopping.is_set():
+                    block = source.read(blocksize)
+                    if not block:
+                        break
+                    self._put(block)
+        except Exception as exc:
+            end = exc
+        finally:
+            self._put(end)
+
+    def _put(self, block):
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(block, timeout=READER_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def read(self, size=-1):
+        if self.finished:
+            return b''
+        block = self.queue.get()
+        if isinstance(block, Exception):
+            self.finished = True
+            if isinstance(block, OSError):
+                raise block
+            raise OSError("corrupt compressed data: %s" % block) from block
+        self.finished = not block
+        return block
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+
+
+def scan_blocks(infile, blocksize=BLOCKSIZE, scanner=None):
+    """
+    Yield the records of a binary stream, read blocksize bytes at a
+    time. A line split across blocks is carried over to the next one.
+    """
+    scanner = scanner or Scanner()
+    rest = b''
+    while True:
+        block = infile.read(blocksize)
+        if not block:
+            break
+        if rest:
+            block = rest + block
+        end = block.rfind(b'\n') + 1
+        yield from scanner.scan(block, 0, end)
+        rest = block[end:]
+    yield from scanner.scan(rest)
+
+
+class Scanner:
+    """
+    The line classifier behind scan_records, working directly on
+    offsets into a bytes-like buffer (bytes, mmap or memoryview) so
+    that lines never need to be sliced out. ``status`` carries the
+    last STATUS across calls, and ``lines`` counts the lines scanned.
+    """
+
+    def __init__(self):
+        self.status = None
+        self.lines = 0
+
+    def scan(self, buffer, start=0, end=None):
+        """
+        Yield the records for the lines in buffer[start:end]. A last
+        line without a newline is scanned as a complete line.
+        """
+        if end is None:
+            end = len(buffer)
+        find = buffer.find
+        lines = 0
+        try:
+            while start < end:
+                stop = find(b'\n', start, end)
+                stop = end if stop < 0 else stop + 1
+                lines += 1
+
+                at = find(b'@', start, stop)
+                if at >= 0:
+                    volts = _digits(buffer, at + 2, stop)
+                    if at + 3 < stop and buffer[at + 3:at + 4] in (b'K', b'k'):
+                        volts *= 1000
+                    yield VOLTAGE, volts
+
+                position = find(b'S/N', start, stop)
+                serial = position >= 0
+                if serial:
+                    position += 7
+                    if buffer[position:min(position + 1, stop)] == b' ':
+                        if buffer[position + 1:min(position + 2, stop)] == b' ':
+                            position += 2
+                        else:
+                            position += 1
+                    yield SERIAL, _digits(buffer, position, min(position + 4, stop))
+
+                if find(b'   ****', start, stop) >= 0:
+                    yield FAILCODE, _digits(buffer, start + 3, min(start + 6, stop))
+
+                if find(b'938', start, min(start + 6, stop)) == start + 3:
+                    yield IDENTITY, _digits(buffer, start + 14, min(start + 17, stop))
+
+                failed = find(b'FAIL', start, min(start + 23, stop)) == start + 19
+                if serial or failed != self.status:
+                    self.status = failed
+                    yield STATUS, failed
+
+                start = stop
+        finally:
+            self.lines += lines
+
+
+def _digits(line, start, end=sys.maxsize):
+    """
+    Return the value of the digits at the start of line[start:end],
+    or 0 if there are none (like atoi).
+
+    >>> _digits(b"S/N 12AB", 4), _digits(b"12345", 0, 3), _digits(b"x", 0)
+    (12, 123, 0)
+    """
+    digits = _DIGITS.match(line, start, end).group()
+    return int(digits) if digits else 0
+
+
+_DIGITS = re.compile(rb'[0-9]*')
+
+
+def filecopy(infile):
+    while True:
+        c = infile.read(1)
+        if not c:
+            break
+        sys.stdout.write(c, flush=True)
 
 
 def get_digits(s):
@@ -728,70 +2921,166 @@ def atoi(s):
     return functools.reduce(ten_x, ordinals, 0)
 
 
-def ser2pro(sn):
-    global buf
+class RangeTable:
+    """
+    Sorted interval index over a PROCESS.DAT or DESIGN.DAT style table.
+
+    Ranges are kept disjoint; when a later range overlaps an earlier
+    one, the later range wins over the overlapping span (matching the
+    old scan, where the last matching line took effect) and the
+    collision is recorded in ``overlaps``.
+
+    >>> table = RangeTable([(1, 10, 'A Process'), (5, 20, 'B Process')])
+    >>> table.lookup(4), table.lookup(5), table.lookup(21)
+    ('A Process', 'B Process', None)
+    >>> table.overlaps
+    [((5, 10, 'A Process'), (5, 20, 'B Process'))]
+    """
+
+    def __init__(self, ranges=()):
+        self.lows = []
+        self.highs = []
+        self.names = []
+        self.overlaps = []
+        for low, high, name in ranges:
+            self.add(low, high, name)
+        self.lookup = functools.lru_cache(maxsize=None)(self._lookup)
+
+    def add(self, low, high, name):
+        if low > high:
+            return
+        start = bisect.bisect_left(self.highs, low)
+        stop = bisect.bisect_right(self.lows, high)
+        pieces = []
+        for i in range(start, stop):
+            self.overlaps.append((
+                (max(self.lows[i], low), min(self.highs[i], high), self.names[i]),
+                (low, high, name),
+            ))
+        if start < stop and self.lows[start] < low:
+            pieces.append((self.lows[start], low - 1, self.names[start]))
+        pieces.append((low, high, name))
+        if start < stop and self.highs[stop - 1] > high:
+            pieces.append((high + 1, self.highs[stop - 1], self.names[stop - 1]))
+        self.lows[start:stop] = [piece[0] for piece in pieces]
+        self.highs[start:stop] = [piece[1] for piece in pieces]
+        self.names[start:stop] = [piece[2] for piece in pieces]
+
+    def _lookup(self, key):
+        i = bisect.bisect_right(self.lows, key) - 1
+        if i >= 0 and key <= self.highs[i]:
+            return self.names[i]
+        return None
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        Build a table from lines of the form
+        ``N LLLL HHHH [LLLL HHHH ...] Name``, where N is the number
+        of low/high pairs that map to Name.
+        """
+        return cls(itertools.chain.from_iterable(map(parse_ranges, lines)))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as init:
+            return cls.parse(init)
+
+
+def parse_ranges(line):
+    """
+    Return the (low, high, name) ranges described by one table line.
+
+    >>> parse_ranges("2 0001 0099 0200 0299 A Process\\n")
+    [(1, 99, 'A Process'), (200, 299, 'A Process')]
+    """
+    if not line or line[0] < '0' or line[0] > '9':
+        return []
+    counter = atoi(line)
+    name = line[2 + (10*counter):].rstrip('\n')
+    return [
+        (atoi(line[2 + (10*i):]), atoi(line[7 + (10*i):]), name)
+        for i in range(counter)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def load_range_table(filename):
+    """
+    Load the named range table once, or return None if it can't be read.
+    """
     try:
-        init = open("PROCESS.DAT", "r")
-    except Exception:
-        init = None
+        return RangeTable.load(filename)
+    except OSError:
+        return None
+
+
+def report_overlaps(filename):
+    table = load_range_table(filename)
+    if table is None:
+        return
+    for (low, high, name), (new_low, new_high, new_name) in table.overlaps:
+        print(
+            "Warning: %s range %d-%d (%s) overlaps %d-%d (%s); using %s."
+            % (filename, new_low, new_high, new_name, low, high, name, new_name),
+            file=sys.stderr)
 
-    if init is not None:
-        while True:
-            inline = init.read(MAXLINE)
-            if not inline:
-                break
-            if inline[0] < '0' or inline[0] > '9':
-                continue
-            counter = atoi(inline)
-            for i in range(counter):
-                low = atoi(inline[2 + (10*i):])
-                high = atoi(inline[7 + (10*i):])
-                if sn >= low and sn <= high:
-                    buf = inline[2 + (10*counter):]
-
-        for i in range(MAXNAME):
-            if buf[i] == '\n':
-                buf = buf[:i]
-                break
-
-        init.close()
-        return buf
-
-    init.close()
-    return None
+
+def lookup(filename, key):
+    table = load_range_table(filename)
+    return None if table is None else table.lookup(key)
+
+
+def ser2pro(sn):
+    return lookup(PROCESS_FILENAME, sn)
 
 
 def res2des(resval):
-    global buf
-    try:
-        init = open("DESIGN.DAT", "r")
-    except Exception:
-        init = None
+    return lookup(DESIGN_FILENAME, resval)
 
-    if init is not None:
-        while True:
-            inline = init.read(MAXLINE)
-            if not inline:
-                break
-            if inline[0] < '0' or inline[0] > '9':
-                continue
-            counter = atoi(inline)
-            for i in range(counter):
-                low = atoi(inline[2 + (10*i):])
-                high = atoi(inline[7 + (10*i):])
-                if resval >= low and resval <= high:
-                    buf = inline[2 + (10*counter):]
-
-        for i in range(MAXNAME):
-            if buf[i] == '\n':
-                buf = buf[:i]
-                break
-
-        init.close()
-        return buf
-
-    init.close()
-    return None
+
+def parse_failcodes(lines):
+    """
+    Build a fail code map from lines of the form ``CODE TYPE``, where
+    TYPE names one of the FAILTYPES columns. Lines that don't start
+    with a digit are ignored.
+
+    >>> parse_failcodes(["# new codes\\n", "861 ICC\\n", "300 cont\\n"])
+    {861: 0, 300: 12}
+    >>> parse_failcodes(["861\\n"])
+    Traceback (most recent call last):
+    ...
+    ValueError: no fail type for fail code 861
+    """
+    failcodes = {}
+    for line in lines:
+        if not line or line[0] < '0' or line[0] > '9':
+            continue
+        fields = line.split()
+        if len(fields) < 2:
+            raise ValueError("no fail type for fail code %s" % fields[0])
+        code, failtype = fields[:2]
+        try:
+            failcodes[atoi(code)] = FAILTYPES.index(failtype.lower())
+        except ValueError:
+            raise ValueError(
+                "unknown fail type %s for fail code %s" % (failtype, code))
+    return failcodes
+
+
+@functools.lru_cache(maxsize=None)
+def load_failcodes(filename):
+    """
+    Return the built-in FAILCODES, extended and overridden by the
+    named file if it exists.
+    """
+    failcodes = dict(FAILCODES)
+    try:
+        with open(filename, "r") as init:
+            failcodes.update(parse_failcodes(init))
+    except OSError:
+        pass
+    return failcodes
 
 
 def truncate(filename):